@@ -0,0 +1,102 @@
+import hashlib
+
+from django.contrib.auth import get_user_model
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
+
+from constants import RESPONSE_CACHE_MAX_AGE
+from recipes.models import Recipe
+
+from .ingredients import get_catalog_version
+from .relations import get_relations_generation, get_user_relations
+from .tags import get_tags_version
+
+User = get_user_model()
+
+
+class Validators:
+    # ETag and Last-Modified of one representation, computed from version
+    # columns and cached version keys without running the serializer.
+    __slots__ = ('etag', 'last_modified')
+
+    def __init__(self, request, parts, timestamps):
+        source = repr((
+            request.build_absolute_uri('/'), request.accepted_media_type,
+            parts
+        ))
+        self.etag = (
+            f'"{hashlib.sha256(source.encode("utf-8")).hexdigest()[:32]}"'
+        )
+        self.last_modified = int(max(timestamps))
+
+
+def _personal_state(request):
+    # The personal flags go into the ETag as they are. Last-Modified only
+    # knows when any of the user's relations last changed.
+    relations = get_user_relations(request)
+    if relations is None:
+        return None, ()
+    return relations, (get_relations_generation(request.user.pk) / 1e9,)
+
+
+def recipe_validators(request, pk):
+    row = Recipe.objects.filter(pk=pk).values_list(
+        'version', 'updated_at', 'author_id', 'author__version',
+        'author__updated_at'
+    ).first()
+    if row is None:
+        return None
+    version, updated_at, author_id, author_version, author_updated_at = row
+    tags_version, catalog_version = get_tags_version(), get_catalog_version()
+    relations, generations = _personal_state(request)
+    flags = relations and (
+        pk in relations.favorites, pk in relations.cart,
+        author_id in relations.following
+    )
+    return Validators(
+        request,
+        (pk, version, updated_at, author_version, author_updated_at,
+         tags_version, catalog_version, flags),
+        (updated_at.timestamp(), author_updated_at.timestamp(),
+         tags_version / 1e9, catalog_version / 1e9, *generations)
+    )
+
+
+def user_validators(request, pk):
+    if pk == request.user.pk:
+        version, updated_at = request.user.version, request.user.updated_at
+    else:
+        row = User.objects.filter(pk=pk).values_list(
+            'version', 'updated_at'
+        ).first()
+        if row is None:
+            return None
+        version, updated_at = row
+    relations, generations = _personal_state(request)
+    flags = relations and pk in relations.following
+    return Validators(
+        request, (pk, version, updated_at, flags),
+        (updated_at.timestamp(), *generations)
+    )
+
+
+def conditional_response(request, validators, build):
+    # Matching If-None-Match / If-Modified-Since requests get a 304 before
+    # anything is serialized.
+    response = get_conditional_response(
+        request, etag=validators.etag,
+        last_modified=validators.last_modified
+    )
+    if response is None:
+        response = build()
+        if response.status_code != 200:
+            return response
+    response['ETag'] = validators.etag
+    response['Last-Modified'] = http_date(validators.last_modified)
+    if not response.has_header('Cache-Control'):
+        response['Cache-Control'] = (
+            'private, no-cache' if request.user.is_authenticated
+            else f'public, max-age={RESPONSE_CACHE_MAX_AGE}'
+        )
+    patch_vary_headers(response, ('Authorization',))
+    return response
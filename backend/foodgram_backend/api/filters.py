@@ -1,11 +1,21 @@
 import django_filters
-from recipes.models import Recipe
+from django.contrib.postgres.search import (
+    SearchQuery, SearchRank, TrigramSimilarity
+)
+from django.db.models import Exists, F, OuterRef, Q
+from recipes.models import Favorite, Recipe, ShoppingCart
 from rest_framework import filters as rest_filters
-import logging
 
+from constants import RELATION_FILTER_MAX_IDS
 from users.models import User
 
-logger = logging.getLogger(__name__)
+from .relations import MODEL_RELATIONS, get_user_relations
+from .tags import tag_cache
+
+
+def tag_slug_choices():
+    # A plain function, since FilterSet deep-copies its filters.
+    return tag_cache.slug_choices()
 
 
 class RecipeCustomFilter(django_filters.rest_framework.FilterSet):
@@ -20,32 +30,62 @@ class RecipeCustomFilter(django_filters.rest_framework.FilterSet):
     is_in_shopping_cart = django_filters.rest_framework.BooleanFilter(
         method='get_shopping_cart_recipes'
     )
+    tags = django_filters.rest_framework.MultipleChoiceFilter(
+        choices=tag_slug_choices,
+        method='get_tagged_recipes'
+    )
 
     class Meta:
         model = Recipe
         fields = ['author']
 
+    def get_tagged_recipes(self, queryset, field_name, slugs):
+        if not slugs:
+            return queryset
+        # A semi-join on the (recipe, tag) unique index: each recipe is
+        # returned once however many of the selected tags it has.
+        return queryset.filter(Exists(Recipe.tags.through.objects.filter(
+            recipe=OuterRef('pk'),
+            tag_id__in=tag_cache.ids_for_slugs(slugs)
+        )))
+
     def get_favorite_recipes(self, queryset, field_name, filter_value):
-        user = self.request.user
-        logger.debug(f"get_favorite_recipes: user={user}, authenticated={user.is_authenticated}, filter_value={filter_value}")
-        if user.is_authenticated:
-            if filter_value:
-                return queryset.filter(favorites__user=user)
-            else:
-                return queryset.exclude(favorites__user=user)
-        return queryset
+        return self._filter_by_relation(queryset, Favorite, filter_value)
 
     def get_shopping_cart_recipes(self, queryset, field_name, filter_value):
-        user = self.request.user
-        logger.debug(f"get_shopping_cart_recipes: user={user}, authenticated={user.is_authenticated}, filter_value={filter_value}")
-        if user.is_authenticated:
-            if filter_value:
-                return queryset.filter(shopping_cart__user=user)
-            else:
-                return queryset.exclude(shopping_cart__user=user)
-        return queryset
+        return self._filter_by_relation(queryset, ShoppingCart, filter_value)
+
+    def _filter_by_relation(self, queryset, model, filter_value):
+        # Small cached id sets become a plain pk IN (...); larger ones fall
+        # back to a correlated (NOT) EXISTS on the (user, recipe) unique
+        # index. Neither way multiplies rows when filters are combined.
+        relations = get_user_relations(self.request)
+        if relations is None:
+            return queryset
+        ids = getattr(relations, MODEL_RELATIONS[model])
+        if len(ids) <= RELATION_FILTER_MAX_IDS:
+            relation = Q(pk__in=ids)
+        else:
+            relation = Exists(model.objects.filter(
+                user=self.request.user, recipe=OuterRef('pk')
+            ))
+        return queryset.filter(relation if filter_value else ~relation)
 
 
-class IngredientNameSearchFilter(rest_filters.SearchFilter):
+class RecipeSearchFilter(rest_filters.SearchFilter):
 
-    search_param = "name"
\ No newline at end of file
+    def filter_queryset(self, request, queryset, view):
+        term = request.query_params.get(self.search_param, '').strip()
+        if not term:
+            return queryset
+        query = SearchQuery(term, config='russian', search_type='websearch')
+        # Full-text matches use the GIN index on search_vector, typos in the
+        # name are caught by the trigram index on name.
+        return queryset.filter(
+            Q(search_vector=query) | Q(name__trigram_similar=term)
+        ).annotate(
+            search_rank=(
+                SearchRank(F('search_vector'), query)
+                + TrigramSimilarity('name', term)
+            )
+        ).order_by('-search_rank', '-pub_date')
@@ -0,0 +1,222 @@
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
+from django.db.models import F
+from django.dispatch import Signal
+from django.utils import timezone
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from constants import (
+    AVATAR_IMAGE_WIDTHS,
+    IMAGE_MAX_PIXELS,
+    IMAGE_MAX_SIDE,
+    IMAGE_MIN_SIDE,
+    IMAGE_WORKERS,
+    RECIPE_IMAGE_WIDTHS
+)
+
+logger = logging.getLogger(__name__)
+
+# Sent with sender=model and pk once new renditions have been saved. The
+# update bypasses save(), so post_save receivers never see it.
+renditions_stored = Signal()
+
+RENDITION_FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', {'quality': 82, 'progressive': True, 'optimize': True}),
+}
+
+RENDITION_WIDTHS = {
+    'image': RECIPE_IMAGE_WIDTHS,
+    'avatar': AVATAR_IMAGE_WIDTHS,
+}
+
+
+def validate_image_dimensions(image):
+    # Only the header is read here, the pixels are decoded later by the
+    # worker processes.
+    try:
+        image.seek(0)
+        with Image.open(image) as picture:
+            width, height = picture.size
+    except (UnidentifiedImageError, OSError):
+        raise ValidationError('Не удалось прочитать изображение.')
+    finally:
+        image.seek(0)
+    if min(width, height) < IMAGE_MIN_SIDE:
+        raise ValidationError(
+            f'Изображение меньше {IMAGE_MIN_SIDE} px по одной из сторон.'
+        )
+    if (
+        max(width, height) > IMAGE_MAX_SIDE
+        or width * height > IMAGE_MAX_PIXELS
+    ):
+        raise ValidationError(
+            f'Изображение больше {IMAGE_MAX_SIDE} px по одной из сторон.'
+        )
+
+
+def render_renditions(media_root, name, widths):
+    # Runs in a worker process: no Django state is used here, only the
+    # files under MEDIA_ROOT.
+    directory, filename = os.path.split(name)
+    stem = os.path.splitext(filename)[0]
+    os.makedirs(os.path.join(media_root, directory, 'renditions'),
+                exist_ok=True)
+    renditions = {file_format: {} for file_format in RENDITION_FORMATS}
+    with Image.open(os.path.join(media_root, name)) as source:
+        source = ImageOps.exif_transpose(source).convert('RGB')
+        for width in sorted(widths, reverse=True):
+            width = min(width, source.width)
+            if str(width) in renditions['webp']:
+                continue
+            height = max(round(source.height * width / source.width), 1)
+            resized = source.resize((width, height), Image.LANCZOS)
+            for extension, (file_format, params) in RENDITION_FORMATS.items():
+                rendition = os.path.join(
+                    directory, 'renditions', f'{stem}-{width}.{extension}'
+                )
+                resized.save(
+                    os.path.join(media_root, rendition), file_format, **params
+                )
+                renditions[extension][str(width)] = rendition
+    return renditions
+
+
+def _remove_files(media_root, renditions):
+    for names in renditions.values():
+        for name in names.values():
+            try:
+                os.remove(os.path.join(media_root, name))
+            except FileNotFoundError:
+                pass
+
+
+class ImagePipeline:
+    # Renditions are produced in a pool of spawned processes after the
+    # upload is committed; the request only stores the original.
+
+    def __init__(self, workers=IMAGE_WORKERS):
+        self._workers = workers
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self._workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                )
+            return self._executor
+
+    def _discard_executor(self, executor):
+        # A pool whose worker died (for example killed for memory while
+        # decoding a huge image) refuses all further work, so it is
+        # replaced by a new one on the next upload.
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def process(self, instance, field_name):
+        # Called after the new file has been saved. The stale renditions
+        # are dropped at once, so clients fall back to the original until
+        # the new ones are ready.
+        name = getattr(instance, field_name).name
+        renditions_field = f'{field_name}_renditions'
+        stale = getattr(instance, renditions_field)
+        type(instance).objects.filter(pk=instance.pk).update(
+            **{renditions_field: {}}
+        )
+        setattr(instance, renditions_field, {})
+        transaction.on_commit(lambda: self._submit(
+            type(instance), instance.pk, field_name, name, stale
+        ), robust=True)
+
+    def clear(self, instance, field_name):
+        # The renditions field is denormalized and skipped by save(), so
+        # it is emptied here the same way _store fills it. The version is
+        # moved in memory as well, so a following save() does not write
+        # the old one back.
+        renditions_field = f'{field_name}_renditions'
+        stale = getattr(instance, renditions_field)
+        model, pk, now = type(instance), instance.pk, timezone.now()
+        model.objects.filter(pk=pk).update(**{
+            renditions_field: {},
+            'version': F('version') + 1,
+            'updated_at': now,
+        })
+        setattr(instance, renditions_field, {})
+        instance.version += 1
+        instance.updated_at = now
+
+        def cleared():
+            _remove_files(settings.MEDIA_ROOT, stale)
+            renditions_stored.send(sender=model, pk=pk)
+        transaction.on_commit(cleared, robust=True)
+
+    def _submit(self, model, pk, field_name, name, stale):
+        if stale:
+            _remove_files(settings.MEDIA_ROOT, stale)
+        if not name:
+            return
+        for _ in range(2):
+            executor = self._get_executor()
+            try:
+                future = executor.submit(
+                    render_renditions, str(settings.MEDIA_ROOT), name,
+                    RENDITION_WIDTHS[field_name],
+                )
+            except BrokenProcessPool:
+                logger.warning('Пул обработки изображений сломан, '
+                               'создаётся новый.')
+                self._discard_executor(executor)
+                continue
+            future.add_done_callback(lambda done: self._store(
+                done, executor, model, pk, field_name, name
+            ))
+            return
+        logger.error('Не удалось поставить в обработку изображение %s', name)
+
+    def _store(self, future, executor, model, pk, field_name, name):
+        try:
+            renditions = future.result()
+        except BrokenProcessPool:
+            # The image is not resubmitted: it may be the one that killed
+            # the worker. Clients keep using the original.
+            logger.exception('Пул обработки изображений сломан при '
+                             'обработке %s', name)
+            self._discard_executor(executor)
+            return
+        except Exception:
+            logger.exception('Не удалось обработать изображение %s', name)
+            return
+        try:
+            # The filter on the file name skips the write when the image
+            # was replaced while this one was being processed.
+            # Renditions are part of the API representation, so the version
+            # used for conditional requests moves with them.
+            updated = model.objects.filter(
+                pk=pk, **{field_name: name}
+            ).update(**{
+                f'{field_name}_renditions': renditions,
+                'version': F('version') + 1,
+                'updated_at': timezone.now(),
+            })
+            if not updated:
+                _remove_files(settings.MEDIA_ROOT, renditions)
+            else:
+                renditions_stored.send(sender=model, pk=pk)
+        finally:
+            connection.close()
+
+
+image_pipeline = ImagePipeline()
@@ -0,0 +1,122 @@
+import bisect
+import gzip
+import hashlib
+import json
+
+from constants import INGREDIENT_INDEX_TTL
+from recipes.models import Ingredient
+
+from .versioning import VersionedSnapshot, bump_versions, get_version
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+CATALOG_VERSION_KEY = 'ingredients:catalog_version'
+
+
+def get_catalog_version():
+    return get_version(CATALOG_VERSION_KEY)
+
+
+def bump_catalog_version():
+    bump_versions([CATALOG_VERSION_KEY])
+
+
+def parse_accept_encoding(header):
+    # Codings sent with q=0 are refused rather than accepted, and '*'
+    # stands for every coding the header does not name.
+    accepted, refused = set(), set()
+    for part in header.split(','):
+        coding, *params = (item.strip() for item in part.split(';'))
+        if not coding:
+            continue
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        (accepted if quality > 0 else refused).add(coding.lower())
+    if '*' in accepted:
+        accepted.update(('br', 'gzip'))
+    return accepted - refused
+
+
+class IngredientCatalog:
+    __slots__ = ('etag', 'encodings')
+
+    def __init__(self, rows):
+        content = json.dumps(
+            rows, ensure_ascii=False, separators=(',', ':')
+        ).encode('utf-8')
+        self.etag = hashlib.sha256(content).hexdigest()[:32]
+        self.encodings = {
+            'identity': content,
+            'gzip': gzip.compress(content, compresslevel=9, mtime=0),
+        }
+        if brotli is not None:
+            self.encodings['br'] = brotli.compress(content)
+
+    def get(self, accepted_encodings):
+        for encoding in ('br', 'gzip'):
+            if encoding in accepted_encodings and encoding in self.encodings:
+                return (
+                    encoding, f'"{self.etag}-{encoding}"',
+                    self.encodings[encoding]
+                )
+        return 'identity', f'"{self.etag}"', self.encodings['identity']
+
+
+class IngredientPrefixIndex(VersionedSnapshot):
+    version_key = CATALOG_VERSION_KEY
+    ttl = INGREDIENT_INDEX_TTL
+    __slots__ = ('_catalog',)
+
+    def __init__(self):
+        super().__init__()
+        self._catalog = None
+
+    def build(self):
+        entries = sorted(
+            (name.casefold(), pk, name, unit)
+            for pk, name, unit in Ingredient.objects.values_list(
+                'id', 'name', 'measurement_unit'
+            )
+        )
+        return (
+            tuple(entry[0] for entry in entries),
+            tuple(
+                {'id': pk, 'name': name, 'measurement_unit': unit}
+                for _, pk, name, unit in entries
+            ),
+        )
+
+    def catalog(self):
+        # The compressed catalog is built at most once per index load and is
+        # kept next to the data it was built from.
+        data = self.load()
+        built = self._catalog
+        if built is None or built[0] is not data:
+            built = (data, IngredientCatalog(list(data[1])))
+            self._catalog = built
+        return built[1]
+
+    def search(self, term=''):
+        keys, rows = self.load()
+        term = term.strip().casefold()
+        if not term:
+            return list(rows)
+        start = bisect.bisect_left(keys, term)
+        end = bisect.bisect_left(keys, term + '\U0010ffff', start)
+        substring_matches = [
+            row for key, row in zip(keys, rows)
+            if term in key and not key.startswith(term)
+        ]
+        return list(rows[start:end]) + substring_matches
+
+
+ingredient_index = IngredientPrefixIndex()
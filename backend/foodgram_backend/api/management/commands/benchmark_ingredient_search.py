@@ -0,0 +1,58 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.ingredients import ingredient_index
+from api.serializers import IngredientSerializer
+from recipes.models import Ingredient
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает задержку автодополнения ингредиентов: фильтр '
+        'istartswith в базе против индекса в памяти.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--queries', type=int, default=1000,
+            help='Число запросов для каждого способа.'
+        )
+        parser.add_argument(
+            '--seed', type=int, default=0,
+            help='Зерно генератора случайных префиксов.'
+        )
+
+    def _measure(self, search, terms):
+        timings = []
+        for term in terms:
+            started = time.perf_counter()
+            search(term)
+            timings.append((time.perf_counter() - started) * 1000)
+        percentiles = statistics.quantiles(timings, n=100)
+        return percentiles[49], percentiles[98]
+
+    def handle(self, *args, **options):
+        names = list(Ingredient.objects.values_list('name', flat=True))
+        if not names:
+            raise CommandError('Таблица ингредиентов пуста.')
+        rng = random.Random(options['seed'])
+        terms = []
+        for _ in range(options['queries']):
+            name = rng.choice(names)
+            terms.append(name[:rng.randint(1, min(len(name), 4))])
+
+        def database_search(term):
+            return IngredientSerializer(
+                Ingredient.objects.filter(name__istartswith=term), many=True
+            ).data
+
+        ingredient_index.search()
+        for label, search in (
+            ('База данных', database_search),
+            ('Индекс в памяти', ingredient_index.search),
+        ):
+            p50, p99 = self._measure(search, terms)
+            self.stdout.write(f'{label}: p50={p50:.3f} мс, p99={p99:.3f} мс')
@@ -0,0 +1,149 @@
+import random
+import statistics
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Exists, OuterRef
+
+from constants import DEFAULT_PAGE_SIZE
+from recipes.models import Recipe, Tag
+
+User = get_user_model()
+RecipeTag = Recipe.tags.through
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает фильтрацию рецептов по тегам: JOIN с DISTINCT против '
+        'подзапроса EXISTS. Может сгенерировать тестовые рецепты: они '
+        'создаются в транзакции, которая после замера откатывается.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--generate', type=int, default=0,
+            help='Сколько тестовых рецептов создать перед замером.'
+        )
+        parser.add_argument(
+            '--allow-writes', action='store_true',
+            help='Разрешить --generate писать в настроенную базу.'
+        )
+        parser.add_argument(
+            '--keep', action='store_true',
+            help='Сохранить сгенерированные рецепты вместо отката.'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=10000,
+            help='Число рецептов в одной пачке INSERT при генерации.'
+        )
+        parser.add_argument(
+            '--queries', type=int, default=200,
+            help='Число запросов для каждого способа.'
+        )
+        parser.add_argument(
+            '--seed', type=int, default=0,
+            help='Зерно генератора случайных наборов тегов.'
+        )
+        parser.add_argument(
+            '--explain', action='store_true',
+            help='Вывести план запроса с EXISTS.'
+        )
+
+    def _generate(self, count, batch_size, tag_ids, rng):
+        author, _ = User.objects.get_or_create(
+            username='benchmark',
+            defaults={'email': 'benchmark@example.com'}
+        )
+        for start in range(0, count, batch_size):
+            size = min(batch_size, count - start)
+            recipes = Recipe.objects.bulk_create(
+                Recipe(
+                    author=author,
+                    name=f'Тестовый рецепт {start + index}',
+                    text='Сгенерирован для замера фильтра по тегам.',
+                    cooking_time=rng.randint(1, 120),
+                    image='recipes/benchmark.png',
+                )
+                for index in range(size)
+            )
+            RecipeTag.objects.bulk_create(
+                RecipeTag(recipe_id=recipe.pk, tag_id=tag_id)
+                for recipe in recipes
+                for tag_id in rng.sample(
+                    tag_ids, rng.randint(1, min(3, len(tag_ids)))
+                )
+            )
+            self.stdout.write(f'Создано рецептов: {start + size}')
+        # The planner statistics have to include the new rows; ANALYZE
+        # counts the rows of its own transaction.
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'ANALYZE {Recipe._meta.db_table}, {RecipeTag._meta.db_table}'
+            )
+
+    def _join_distinct(self, slugs):
+        queryset = Recipe.objects.filter(tags__slug__in=slugs).distinct()
+        return queryset.count(), list(queryset[:DEFAULT_PAGE_SIZE])
+
+    def _exists(self, slugs):
+        # Slugs are resolved in memory, as the API does with its tag cache.
+        tag_ids = [self.tags[slug] for slug in slugs]
+        queryset = Recipe.objects.filter(Exists(RecipeTag.objects.filter(
+            recipe=OuterRef('pk'), tag_id__in=tag_ids
+        )))
+        return queryset.count(), list(queryset[:DEFAULT_PAGE_SIZE])
+
+    def _measure(self, query, selections):
+        timings = []
+        for slugs in selections:
+            started = time.perf_counter()
+            query(slugs)
+            timings.append((time.perf_counter() - started) * 1000)
+        percentiles = statistics.quantiles(timings, n=100)
+        return percentiles[49], percentiles[98]
+
+    def _benchmark(self, tags, rng, options):
+        slugs = list(tags)
+        selections = [
+            rng.sample(slugs, rng.randint(1, min(3, len(slugs))))
+            for _ in range(options['queries'])
+        ]
+        self.stdout.write(f'Рецептов в базе: {Recipe.objects.count()}')
+        for label, query in (
+            ('JOIN + DISTINCT', self._join_distinct),
+            ('EXISTS', self._exists),
+        ):
+            p50, p99 = self._measure(query, selections)
+            self.stdout.write(f'{label}: p50={p50:.3f} мс, p99={p99:.3f} мс')
+        if options['explain']:
+            tag_ids = [tags[slug] for slug in selections[0]]
+            self.stdout.write(Recipe.objects.filter(Exists(
+                RecipeTag.objects.filter(
+                    recipe=OuterRef('pk'), tag_id__in=tag_ids
+                )
+            ))[:DEFAULT_PAGE_SIZE].explain(analyze=True))
+
+    def handle(self, *args, **options):
+        if options['generate'] and not options['allow_writes']:
+            raise CommandError(
+                '--generate создаёт рецепты в настроенной базе, добавьте '
+                '--allow-writes, если это не рабочая база.'
+            )
+        if options['keep'] and not options['generate']:
+            raise CommandError('--keep используется только с --generate.')
+        self.tags = tags = dict(Tag.objects.values_list('slug', 'pk'))
+        if not tags:
+            raise CommandError('Нет ни одного тега.')
+        rng = random.Random(options['seed'])
+        with transaction.atomic():
+            if options['generate']:
+                self._generate(
+                    options['generate'], options['batch_size'],
+                    list(tags.values()), rng
+                )
+            self._benchmark(tags, rng, options)
+            if options['generate'] and not options['keep']:
+                transaction.set_rollback(True)
+                self.stdout.write('Сгенерированные рецепты удалены.')
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api.response_cache import get_stats, reset_stats, stats_are_shared
+
+
+class Command(BaseCommand):
+    help = (
+        'Показывает долю попаданий и среднее время ответа кеша '
+        'анонимных запросов к рецептам.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--reset', action='store_true',
+            help='Обнулить счётчики после вывода.'
+        )
+
+    def handle(self, *args, **options):
+        if not stats_are_shared():
+            raise CommandError(
+                'Кеш не общий для процессов: счётчики сервера этой команде '
+                'не видны. Задайте REDIS_URL или смотрите строки '
+                'response_cache в логах api.response_cache.'
+            )
+        for kind, outcomes in get_stats().items():
+            (hits, hit_time), (misses, miss_time) = (
+                outcomes['hit'], outcomes['miss']
+            )
+            total = hits + misses
+            ratio = hits / total * 100 if total else 0
+            self.stdout.write(
+                f'{kind}: запросов {total}, попаданий {ratio:.1f}%, '
+                f'среднее время: попадание '
+                f'{hit_time / hits / 1000 if hits else 0:.2f} мс, '
+                f'промах {miss_time / misses / 1000 if misses else 0:.2f} мс'
+            )
+        if options['reset']:
+            reset_stats()
+            self.stdout.write(self.style.SUCCESS('Счётчики обнулены.'))
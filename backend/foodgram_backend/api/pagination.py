@@ -1,9 +1,19 @@
+import base64
+import binascii
+import json
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
 from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 
 from constants import (
     DEFAULT_PAGE_SIZE,
     MAX_PAGE_SIZE
 )
+from recipes.feed import get_feed_positions
 
 
 class CustomPageNumberPagination(PageNumberPagination):
@@ -11,3 +21,117 @@ class CustomPageNumberPagination(PageNumberPagination):
     page_query_param = 'page'
     page_size_query_param = 'limit'
     max_page_size = MAX_PAGE_SIZE
+
+
+class KeysetPagination(CustomPageNumberPagination):
+    # Requests with ?cursor= (empty for the first page) are paginated by
+    # keyset_fields in descending order, without OFFSET and COUNT(*).
+    # Everything else keeps the page/limit behaviour.
+    cursor_query_param = 'cursor'
+    keyset_fields = ('pub_date', 'id')
+    keyset_only = False
+    invalid_cursor_message = 'Некорректный курсор.'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.use_keyset = (
+            self.keyset_only
+            or self.cursor_query_param in request.query_params
+        )
+        if not self.use_keyset:
+            return super().paginate_queryset(queryset, request, view)
+        self.request = request
+        page_size = self.get_page_size(request)
+        date_field, id_field = self.keyset_fields
+        queryset = queryset.order_by(f'-{date_field}', f'-{id_field}')
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            date_value, id_value = self.decode_cursor(cursor)
+            # Same as (date, id) < (date_value, id_value), written so that
+            # the leading condition can use the composite index.
+            queryset = queryset.filter(
+                Q(**{f'{date_field}__lte': date_value})
+                & (
+                    Q(**{f'{date_field}__lt': date_value})
+                    | Q(**{f'{id_field}__lt': id_value})
+                )
+            )
+        page = list(queryset[:page_size + 1])
+        self.next_position = None
+        if len(page) > page_size:
+            page = page[:page_size]
+            self.next_position = (
+                getattr(page[-1], date_field), getattr(page[-1], id_field)
+            )
+        return page
+
+    def encode_cursor(self, position):
+        date_value, id_value = position
+        return base64.urlsafe_b64encode(
+            json.dumps([date_value.isoformat(), id_value]).encode()
+        ).decode()
+
+    def decode_cursor(self, cursor):
+        try:
+            date_value, id_value = json.loads(
+                base64.urlsafe_b64decode(cursor.encode())
+            )
+            date_value = parse_datetime(date_value)
+            id_value = int(id_value)
+        except (TypeError, ValueError, binascii.Error):
+            raise NotFound(self.invalid_cursor_message)
+        if date_value is None:
+            raise NotFound(self.invalid_cursor_message)
+        return date_value, id_value
+
+    def get_next_link(self):
+        if not self.use_keyset:
+            return super().get_next_link()
+        if self.next_position is None:
+            return None
+        url = remove_query_param(
+            self.request.build_absolute_uri(), self.page_query_param
+        )
+        return replace_query_param(
+            url, self.cursor_query_param,
+            self.encode_cursor(self.next_position)
+        )
+
+    def get_paginated_response(self, data):
+        if not self.use_keyset:
+            return super().get_paginated_response(data)
+        return Response({
+            'next': self.get_next_link(),
+            'previous': None,
+            'results': data,
+        })
+
+
+class RecipePagination(KeysetPagination):
+    keyset_fields = ('pub_date', 'id')
+
+
+class SubscriptionPagination(KeysetPagination):
+    keyset_fields = ('subscription_date', 'subscription_id')
+
+
+class FeedPagination(KeysetPagination):
+    # The page is picked from the (pub_date, id) pairs of the user's feed
+    # and only those recipes are loaded from the queryset.
+    keyset_fields = ('pub_date', 'id')
+    keyset_only = True
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.use_keyset = True
+        self.request = request
+        page_size = self.get_page_size(request)
+        cursor = request.query_params.get(self.cursor_query_param)
+        positions = get_feed_positions(
+            request.user, page_size + 1,
+            self.decode_cursor(cursor) if cursor else None
+        )
+        self.next_position = None
+        if len(positions) > page_size:
+            positions = positions[:page_size]
+            self.next_position = positions[-1]
+        recipes = queryset.in_bulk([pk for _, pk in positions])
+        return [recipes[pk] for _, pk in positions if pk in recipes]
@@ -0,0 +1,29 @@
+from rest_framework.parsers import (
+    FileUploadParser,
+    JSONParser,
+    MultiPartParser
+)
+
+
+class RawImageParser(FileUploadParser):
+    # Accepts the image itself as the request body, e.g.
+    # Content-Type: image/jpeg. The file name is optional.
+    media_type = 'image/*'
+    default_filename = 'upload'
+
+    def get_filename(self, stream, media_type, parser_context):
+        return (
+            super().get_filename(stream, media_type, parser_context)
+            or self.default_filename
+        )
+
+
+IMAGE_UPLOAD_PARSERS = [JSONParser, MultiPartParser, RawImageParser]
+
+
+def get_image_data(request, field_name):
+    # RawImageParser puts the body under 'file', the other parsers under
+    # the field name itself.
+    if field_name not in request.data and 'file' in request.data:
+        return {field_name: request.data['file']}
+    return request.data
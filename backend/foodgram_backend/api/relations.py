@@ -0,0 +1,122 @@
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+
+from constants import RELATION_CACHE_TIMEOUT
+from recipes.models import Favorite, ShoppingCart
+from users.models import Subscription
+
+from .versioning import bump_versions, get_version
+
+REQUEST_ATTRIBUTE = '_user_relations'
+
+RELATIONS = {
+    'favorites': (Favorite, 'user_id', 'recipe_id'),
+    'cart': (ShoppingCart, 'user_id', 'recipe_id'),
+    'following': (Subscription, 'subscriber_id', 'author_id'),
+}
+
+MODEL_RELATIONS = {
+    Favorite: 'favorites',
+    ShoppingCart: 'cart',
+    Subscription: 'following',
+}
+
+
+def _generation_key(user_id):
+    return f'relations:{user_id}:generation'
+
+
+def get_relations_generation(user_id):
+    return get_version(_generation_key(user_id))
+
+
+def _load_ids(user_id, name):
+    model, owner_field, id_field = RELATIONS[name]
+    return model.objects.filter(
+        **{owner_field: user_id}
+    ).values_list(id_field, flat=True)
+
+
+def get_cached_ids(user_id, name):
+    # Sets are stored under the user's current generation. A set read from
+    # the database just before a write can only land under the old
+    # generation, which nobody reads any more.
+    key = f'relations:{user_id}:{name}:{get_relations_generation(user_id)}'
+    ids = cache.get(key)
+    if ids is None:
+        ids = list(_load_ids(user_id, name))
+        cache.add(key, ids, RELATION_CACHE_TIMEOUT)
+    return frozenset(ids)
+
+
+def relations_changed(user_ids, names=RELATIONS):
+    # Runs after the commit, so the new generation is filled from data
+    # every other connection can already see.
+    user_ids = list(user_ids)
+
+    def refresh():
+        for user_id in user_ids:
+            generation = time.time_ns()
+            cache.set(_generation_key(user_id), generation, None)
+            for name in names:
+                cache.add(
+                    f'relations:{user_id}:{name}:{generation}',
+                    list(_load_ids(user_id, name)),
+                    RELATION_CACHE_TIMEOUT
+                )
+
+    if user_ids:
+        transaction.on_commit(refresh)
+
+
+def relations_invalidated(user_ids):
+    # For cascades that touch many users at once. Only the generations are
+    # moved, with one call after the commit, and each user's sets are
+    # loaded again the next time they are read.
+    keys = [_generation_key(user_id) for user_id in user_ids]
+    if keys:
+        transaction.on_commit(lambda: bump_versions(keys))
+
+
+class UserRelations:
+    # The current user's favorites, cart and followed authors as sets of
+    # ids, read from the shared cache the first time they are asked for.
+    __slots__ = ('_user_id', '_sets')
+
+    def __init__(self, user):
+        self._user_id = user.pk
+        self._sets = {}
+
+    def _get(self, name):
+        ids = self._sets.get(name)
+        if ids is None:
+            ids = self._sets[name] = get_cached_ids(self._user_id, name)
+        return ids
+
+    @property
+    def favorites(self):
+        return self._get('favorites')
+
+    @property
+    def cart(self):
+        return self._get('cart')
+
+    @property
+    def following(self):
+        return self._get('following')
+
+
+def get_user_relations(request):
+    # Kept on the Django request itself, so it lives exactly as long as
+    # the request and is never shared between workers, threads or tasks.
+    if request is None or not request.user.is_authenticated:
+        return None
+    user = request.user
+    request = getattr(request, '_request', request)
+    relations = getattr(request, REQUEST_ATTRIBUTE, None)
+    if relations is None:
+        relations = UserRelations(user)
+        setattr(request, REQUEST_ATTRIBUTE, relations)
+    return relations
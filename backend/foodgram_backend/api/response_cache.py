@@ -0,0 +1,185 @@
+import hashlib
+import logging
+import time
+
+from django.core.cache import DEFAULT_CACHE_ALIAS, cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+
+from constants import RESPONSE_CACHE_MAX_AGE, RESPONSE_CACHE_TIMEOUT
+from recipes.models import Recipe
+
+from .versioning import bump_versions, get_versions
+
+logger = logging.getLogger(__name__)
+
+CATALOG_GENERATION_KEY = 'responses:catalog'
+LIST_GENERATION_KEY = 'responses:list'
+STATS_KINDS = ('list', 'detail')
+STATS_OUTCOMES = ('hit', 'miss')
+
+
+def recipe_generation_key(recipe_id):
+    return f'responses:recipe:{recipe_id}'
+
+
+def stats_key(kind, outcome, metric):
+    return f'responses:stats:{kind}:{outcome}:{metric}'
+
+
+def _all_stats_keys():
+    return [
+        stats_key(kind, outcome, metric)
+        for kind in STATS_KINDS
+        for outcome in STATS_OUTCOMES
+        for metric in ('count', 'microseconds')
+    ]
+
+
+def _bump_generations(keys):
+    # Deferred to the commit: a response built from the old rows is stored
+    # under the generation read before the query, which is bumped here.
+    transaction.on_commit(
+        lambda: bump_versions(keys, RESPONSE_CACHE_TIMEOUT)
+    )
+
+
+def catalog_changed():
+    _bump_generations([CATALOG_GENERATION_KEY])
+
+
+def recipes_changed(recipe_ids):
+    _bump_generations(
+        [LIST_GENERATION_KEY]
+        + [recipe_generation_key(pk) for pk in recipe_ids]
+    )
+
+
+def author_changed(author_id):
+    # Recipes embed their author, so a profile or avatar change drops the
+    # pages of that author's recipes only, plus the lists.
+    def bump():
+        recipe_ids = list(Recipe.objects.filter(
+            author_id=author_id
+        ).values_list('pk', flat=True))
+        if recipe_ids:
+            bump_versions(
+                [LIST_GENERATION_KEY]
+                + [recipe_generation_key(pk) for pk in recipe_ids],
+                RESPONSE_CACHE_TIMEOUT
+            )
+
+    transaction.on_commit(bump)
+
+
+def stats_are_shared():
+    # The counters live in the cache, so another process only sees the
+    # ones of the server when the backend is shared between them.
+    return not isinstance(
+        caches[DEFAULT_CACHE_ALIAS], (LocMemCache, DummyCache)
+    )
+
+
+def _record(kind, outcome, started):
+    elapsed = time.perf_counter() - started
+    # One line per response, for log collectors that work whatever the
+    # cache backend is.
+    logger.info(
+        'response_cache kind=%s outcome=%s duration_ms=%.2f',
+        kind, outcome, elapsed * 1000
+    )
+    for metric, value in (
+        ('count', 1), ('microseconds', int(elapsed * 1_000_000))
+    ):
+        key = stats_key(kind, outcome, metric)
+        try:
+            cache.incr(key, value)
+        except ValueError:
+            cache.add(key, value, None)
+    return elapsed
+
+
+def get_stats():
+    values = cache.get_many(_all_stats_keys())
+    return {
+        kind: {
+            outcome: (
+                values.get(stats_key(kind, outcome, 'count'), 0),
+                values.get(stats_key(kind, outcome, 'microseconds'), 0),
+            )
+            for outcome in STATS_OUTCOMES
+        }
+        for kind in STATS_KINDS
+    }
+
+
+def reset_stats():
+    cache.delete_many(_all_stats_keys())
+
+
+def _cache_key(request, kind, generations):
+    # Query parameters are sorted and empty values dropped, so equivalent
+    # URLs share an entry. Host and scheme are part of the key because
+    # image and pagination links are absolute.
+    params = sorted(
+        (name, sorted(value for value in values if value))
+        for name, values in request.query_params.lists()
+        if any(values)
+    )
+    source = repr((
+        request.build_absolute_uri(request.path), params, generations
+    ))
+    digest = hashlib.sha256(source.encode('utf-8')).hexdigest()
+    return f'responses:{kind}:{digest}'
+
+
+def cached_response(
+    request, kind, generation_keys, timeout, build, etag=None
+):
+    # Serves the rendered JSON of anonymous GET requests from the cache.
+    # Authenticated users get personal flags and are never cached here.
+    # Without an explicit etag the hash of the content is used.
+    if (
+        request.user.is_authenticated
+        or request.accepted_renderer.format != 'json'
+    ):
+        response = build()
+        patch_vary_headers(response, ('Authorization',))
+        return response
+    started = time.perf_counter()
+    key = _cache_key(
+        request, kind, get_versions(generation_keys, RESPONSE_CACHE_TIMEOUT)
+    )
+    entry = cache.get(key)
+    if entry is not None:
+        content_etag, content_type, content = entry
+        response = HttpResponse(content, content_type=content_type)
+        outcome = 'hit'
+    else:
+        response = build()
+        if response.status_code != 200:
+            return response
+        renderer = request.accepted_renderer
+        content = renderer.render(
+            response.data, request.accepted_media_type,
+            {'request': request, 'response': response}
+        )
+        content_etag = hashlib.sha256(content).hexdigest()[:32]
+        content_type = renderer.media_type
+        cache.set(key, (content_etag, content_type, content), timeout)
+        response = HttpResponse(content, content_type=content_type)
+        outcome = 'miss'
+    elapsed = _record(kind, outcome, started)
+    response['X-Cache'] = outcome.upper()
+    response['Server-Timing'] = (
+        f'cache;desc="{outcome}";dur={elapsed * 1000:.2f}'
+    )
+    response['ETag'] = etag or f'"{content_etag}"'
+    response['Cache-Control'] = f'public, max-age={RESPONSE_CACHE_MAX_AGE}'
+    patch_vary_headers(response, ('Authorization',))
+    return get_conditional_response(
+        request, etag=response['ETag'], response=response
+    )
@@ -1,62 +1,128 @@
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.db import transaction
+from django.db.models import Prefetch, prefetch_related_objects
 from rest_framework import serializers
 from rest_framework.fields import CurrentUserDefault
 from drf_extra_fields.fields import Base64ImageField
 from djoser.serializers import UserSerializer as DjoserUserSerializer
-import logging
+
+import filetype
 
 from constants import (
     MIN_COOKING_TIME_VALUE,
     MIN_AMOUNT_VALUE
 )
 
+from recipes.counters import change_counter
+from recipes.feed import fan_out_recipe
 from recipes.models import (
     Ingredient,
     Recipe,
     RecipeIngredient,
-    Favorite,
-    ShoppingCart,
+    Tag,
 )
 
 from users.models import Subscription
 
+from .imaging import image_pipeline, validate_image_dimensions
+from .relations import get_user_relations
+from .utils import get_recipes_limit
+
 User = get_user_model()
-logger = logging.getLogger(__name__)
+
+
+class MediaUrlField(serializers.ReadOnlyField):
+    # Reads the URL stored at upload time; only the host is prepended.
+
+    def to_representation(self, value):
+        if not value:
+            return None
+        request = self.context.get('request')
+        return request.build_absolute_uri(value) if request else value
+
+
+class SrcsetField(serializers.ReadOnlyField):
+    # Renders {"webp": {"320": name, ...}, ...} as srcset strings,
+    # e.g. {"webp": "https://.../r-320.webp 320w, ..."}.
+
+    def to_representation(self, renditions):
+        if not renditions:
+            return None
+        request = self.context.get('request')
+        srcset = {}
+        for file_format, names in renditions.items():
+            urls = []
+            for width, name in sorted(
+                names.items(), key=lambda item: int(item[0])
+            ):
+                url = settings.MEDIA_URL + name
+                if request:
+                    url = request.build_absolute_uri(url)
+                urls.append(f'{url} {width}w')
+            srcset[file_format] = ', '.join(urls)
+        return srcset
 
 
 class UserSerializer(DjoserUserSerializer):
-    avatar = serializers.SerializerMethodField(read_only=True)
+    avatar = MediaUrlField(source='avatar_url')
+    avatar_srcset = SrcsetField(source='avatar_renditions')
     is_subscribed = serializers.SerializerMethodField(read_only=True)
 
     class Meta(DjoserUserSerializer.Meta):
-        fields = DjoserUserSerializer.Meta.fields + ('avatar', 'is_subscribed',)
+        fields = DjoserUserSerializer.Meta.fields + (
+            'avatar', 'avatar_srcset', 'is_subscribed',
+        )
         read_only_fields = fields
 
-    def get_avatar(self, obj):
-        if obj.avatar:
-            request = self.context.get('request')
-            if request:
-                return request.build_absolute_uri(obj.avatar.url)
-            return obj.avatar.url
-        return None
-
     def get_is_subscribed(self, obj):
-        req = self.context.get('request')
-        return (
-            req is not None
-            and req.user.is_authenticated
-            and req.user != obj
-            and obj.subscribers.filter(subscriber=req.user).exists()
-        )
+        annotated = getattr(obj, 'is_subscribed', None)
+        if annotated is not None:
+            return annotated
+        relations = get_user_relations(self.context.get('request'))
+        return relations is not None and obj.pk in relations.following
+
+
+class UploadedImageField(Base64ImageField):
+    # Takes either a base64 string or an uploaded file. Uploaded files are
+    # recognised by their signature bytes instead of being decoded by
+    # Pillow, and are rendered back as the URL stored on upload.
+
+    def to_internal_value(self, data):
+        if isinstance(data, str):
+            return super().to_internal_value(data)
+        kind = filetype.guess(data) if hasattr(data, 'read') else None
+        if kind is None or kind.extension not in self.ALLOWED_TYPES:
+            raise serializers.ValidationError(self.INVALID_TYPE_MESSAGE)
+        data.name = f'upload.{kind.extension}'
+        return serializers.FileField.to_internal_value(self, data)
+
+    def to_representation(self, value):
+        if not value:
+            return None
+        url = getattr(value.instance, value.field.url_field)
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request else url
 
 
 class AvatarSerializer(serializers.ModelSerializer):
-    avatar = Base64ImageField(required=True, allow_null=False)
+    avatar = UploadedImageField(
+        required=True, allow_null=False,
+        validators=[validate_image_dimensions]
+    )
+    avatar_srcset = SrcsetField(source='avatar_renditions')
 
     class Meta:
         model = User
-        fields = ('avatar',)
+        fields = ('avatar', 'avatar_srcset')
+
+    def update(self, instance, validated_data):
+        user = super().update(instance, validated_data)
+        # DRF does not close parsed uploads, the spooled file is closed
+        # here once it has been moved into storage.
+        validated_data['avatar'].close()
+        image_pipeline.process(user, 'avatar')
+        return user
 
 
 class IngredientSerializer(serializers.ModelSerializer):
@@ -86,45 +152,61 @@ class RecipeIngredientSerializer(serializers.ModelSerializer):
 
 class RecipeDetailSerializer(serializers.ModelSerializer):
     author = UserSerializer(read_only=True)
+    tags = TagSerializer(many=True, read_only=True)
     ingredients = RecipeIngredientSerializer(many=True, read_only=True, source='recipe_ingredients')
     is_favorited = serializers.SerializerMethodField(read_only=True)
     is_in_cart = serializers.SerializerMethodField(read_only=True)
-    image = Base64ImageField(read_only=True)
+    image = MediaUrlField(source='image_url')
+    image_srcset = SrcsetField(source='image_renditions')
 
     class Meta:
         model = Recipe
         fields = (
-            'id', 'author', 'ingredients', 'name', 'image', 'text',
-            'cooking_time', 'is_favorited', 'is_in_cart'
+            'id', 'tags', 'author', 'ingredients', 'name', 'image',
+            'image_srcset', 'text', 'cooking_time', 'is_favorited',
+            'is_in_cart'
         )
         read_only_fields = fields
 
-    def _check_relation(self, obj, model):
-        req = self.context.get('request')
-        try:
-            if not req or not req.user.is_authenticated:
-                return False
-            return model.objects.filter(user=req.user, recipe=obj).exists()
-        except Exception as e:
-            logger.exception(f'Error checking relation: {e}')
-            return False
+    def to_representation(self, instance):
+        subscribed = getattr(instance, 'is_author_subscribed', None)
+        if subscribed is not None:
+            instance.author.is_subscribed = subscribed
+        return super().to_representation(instance)
+
+    def _check_relation(self, obj, relation, annotation):
+        # RecipeViewSet annotates the flags with EXISTS subqueries; recipes
+        # built elsewhere are looked up in the user's relation sets, which
+        # are loaded once per request.
+        annotated = getattr(obj, annotation, None)
+        if annotated is not None:
+            return annotated
+        relations = get_user_relations(self.context.get('request'))
+        return relations is not None and obj.pk in getattr(relations, relation)
 
     def get_is_favorited(self, obj):
-        return self._check_relation(obj, Favorite)
+        return self._check_relation(obj, 'favorites', 'is_favorited')
 
     def get_is_in_cart(self, obj):
-        return self._check_relation(obj, ShoppingCart)
+        return self._check_relation(obj, 'cart', 'is_in_cart')
 
 
 class IngredientAmountSerializer(serializers.Serializer):
-    id = serializers.PrimaryKeyRelatedField(queryset=Ingredient.objects.all())
+    # Resolved to Ingredient instances in one query by
+    # RecipeCreateUpdateSerializer.validate_ingredients.
+    id = serializers.IntegerField()
     amount = serializers.IntegerField(min_value=MIN_AMOUNT_VALUE)
 
 
 class RecipeCreateUpdateSerializer(serializers.ModelSerializer):
     ingredients = IngredientAmountSerializer(many=True, required=True)
-    tags = serializers.PrimaryKeyRelatedField(many=True, queryset=Tag.objects.all(), required=True)
-    image = Base64ImageField(required=True, allow_null=False)
+    tags = serializers.ListField(
+        child=serializers.IntegerField(), required=True
+    )
+    image = Base64ImageField(
+        required=True, allow_null=False,
+        validators=[validate_image_dimensions]
+    )
     author = serializers.HiddenField(default=CurrentUserDefault())
     cooking_time = serializers.IntegerField(min_value=MIN_COOKING_TIME_VALUE)
 
@@ -138,12 +220,26 @@ class RecipeCreateUpdateSerializer(serializers.ModelSerializer):
         ids = [item['id'] for item in ingredients]
         if len(ids) != len(set(ids)):
             raise serializers.ValidationError('Ингредиенты в рецепте не повторяються.')
-        return ingredients
+        found = self._get_in_bulk(Ingredient, ids, 'Ингредиенты')
+        return [{**item, 'id': found[item['id']]} for item in ingredients]
 
     def validate_tags(self, tags):
         if not tags:
             raise serializers.ValidationError('Нужно указать хотя бы один тег.')
-        return tags
+        if len(tags) != len(set(tags)):
+            raise serializers.ValidationError('Теги в рецепте не повторяются.')
+        found = self._get_in_bulk(Tag, tags, 'Теги')
+        return [found[pk] for pk in tags]
+
+    def _get_in_bulk(self, model, ids, label):
+        # One query for the whole list; every unknown id is reported.
+        found = model.objects.in_bulk(ids)
+        missing = [pk for pk in ids if pk not in found]
+        if missing:
+            raise serializers.ValidationError(
+                f'{label} с id {", ".join(map(str, missing))} не найдены.'
+            )
+        return found
 
     def _create_ingredients(self, recipe, ingredients_data):
         RecipeIngredient.objects.bulk_create(
@@ -156,41 +252,116 @@ class RecipeCreateUpdateSerializer(serializers.ModelSerializer):
         ingredients_data = validated_data.pop('ingredients')
         tags_data = validated_data.pop('tags')
         recipe = super().create(validated_data)
+        image_pipeline.process(recipe, 'image')
         self._create_ingredients(recipe, ingredients_data)
         recipe.tags.set(tags_data)
+        change_counter(
+            User.objects.filter(pk=recipe.author_id), 'recipes_count', 1
+        )
+        self._change_ingredient_counters(
+            {item['id'].pk for item in ingredients_data}, 1
+        )
+        fan_out_recipe(recipe)
         return recipe
 
+    def _change_ingredient_counters(self, ingredient_ids, delta):
+        if ingredient_ids:
+            change_counter(
+                Ingredient.objects.filter(pk__in=ingredient_ids),
+                'recipes_count', delta
+            )
+
+    def _sync_ingredients(self, recipe, ingredients_data):
+        # Merges the payload into the existing rows: one query each for
+        # deletes, amount updates and inserts, only when there is work.
+        existing = {
+            item.ingredient_id: item
+            for item in recipe.recipe_ingredients.all()
+        }
+        amounts = {item['id'].pk: item['amount'] for item in ingredients_data}
+        removed = existing.keys() - amounts.keys()
+        added = [
+            item for item in ingredients_data
+            if item['id'].pk not in existing
+        ]
+        changed = []
+        for ingredient_id, item in existing.items():
+            amount = amounts.get(ingredient_id)
+            if amount is not None and item.amount != amount:
+                item.amount = amount
+                changed.append(item)
+        if removed:
+            RecipeIngredient.objects.filter(
+                pk__in=[
+                    existing[ingredient_id].pk for ingredient_id in removed
+                ]
+            ).delete()
+        if changed:
+            RecipeIngredient.objects.bulk_update(changed, ['amount'])
+        if added:
+            self._create_ingredients(recipe, added)
+        self._change_ingredient_counters(removed, -1)
+        self._change_ingredient_counters({item['id'].pk for item in added}, 1)
+        if not (removed or changed or added):
+            return False
+        getattr(recipe, '_prefetched_objects_cache', {}).pop(
+            'recipe_ingredients', None
+        )
+        prefetch_related_objects([recipe], Prefetch(
+            'recipe_ingredients',
+            queryset=RecipeIngredient.objects.select_related('ingredient')
+        ))
+        return True
+
     @transaction.atomic
     def update(self, instance, validated_data):
         ingredients_data = validated_data.pop('ingredients', None)
         tags_data = validated_data.pop('tags', None)
         recipe = super().update(instance, validated_data)
-        recipe.recipe_ingredients.all().delete()
-        self._create_ingredients(recipe, ingredients_data)
-        recipe.tags.set(tags_data)
+        if 'image' in validated_data:
+            image_pipeline.process(recipe, 'image')
+        # The shopping list versions are moved by the post_save of the
+        # recipe; the bulk writes below send no signals of their own.
+        if ingredients_data is not None:
+            self._sync_ingredients(recipe, ingredients_data)
+        if tags_data is not None:
+            recipe.tags.set(tags_data)
         return recipe
 
-    def validate(self, data):
-        instance = getattr(self, 'instance', None)
-        if instance and 'ingredients' not in data:
-            raise serializers.ValidationError("Поле 'ingredients' обязательно при обновлении рецепта.")
-        return data
-
     def to_representation(self, instance):
         return RecipeDetailSerializer(instance, context=self.context).data
 
 
 class RecipeShortSerializer(serializers.ModelSerializer):
-    image = Base64ImageField(read_only=True)
+    image = MediaUrlField(source='image_url')
+    image_srcset = SrcsetField(source='image_renditions')
 
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = ('id', 'name', 'image', 'image_srcset', 'cooking_time')
         read_only_fields = fields
 
 
+class RecipeImageSerializer(serializers.ModelSerializer):
+    image = UploadedImageField(
+        required=True, allow_null=False,
+        validators=[validate_image_dimensions]
+    )
+    image_srcset = SrcsetField(source='image_renditions')
+
+    class Meta:
+        model = Recipe
+        fields = ('image', 'image_srcset')
+
+    def update(self, instance, validated_data):
+        recipe = super().update(instance, validated_data)
+        validated_data['image'].close()
+        image_pipeline.process(recipe, 'image')
+        return recipe
+
+
 class AuthorWithRecipesSerializer(UserSerializer):
-    recipes_count = serializers.IntegerField(source='recipe_author.count', read_only=True)
+    recipes_count = serializers.IntegerField(read_only=True)
     recipes = serializers.SerializerMethodField(read_only=True)
 
     class Meta(UserSerializer.Meta):
@@ -198,15 +369,9 @@ class AuthorWithRecipesSerializer(UserSerializer):
         read_only_fields = fields
 
     def get_recipes(self, obj):
-        request = self.context.get('request')
-        default_limit = 3
-        limit_str = request.query_params.get('recipes_limit', default_limit)
-        try:
-            limit = int(limit_str)
-            if limit < 0:
-                limit = 0
-        except (ValueError, TypeError):
-            limit = default_limit
-        recipes_queryset = obj.recipe_author.all()[:limit]
+        recipes_queryset = getattr(obj, 'limited_recipes', None)
+        if recipes_queryset is None:
+            limit = get_recipes_limit(self.context.get('request'))
+            recipes_queryset = obj.recipe_author.all()[:limit]
         serializer = RecipeShortSerializer(recipes_queryset, many=True, context=self.context)
-        return serializer.data
\ No newline at end of file
+        return serializer.data
@@ -0,0 +1,252 @@
+import csv
+import json
+from datetime import datetime
+from itertools import chain
+
+from django.conf import settings
+from django.contrib.postgres.aggregates import ArrayAgg
+from django.core.cache import cache
+from django.db.models import F, Q, Sum, Value
+from django.db.models.functions import Concat
+from fpdf import FPDF
+from rest_framework.negotiation import DefaultContentNegotiation
+from rest_framework.renderers import BaseRenderer
+
+from constants import (
+    SHOPPING_LIST_CACHE_MAX_SIZE,
+    SHOPPING_LIST_CACHE_TIMEOUT,
+    SHOPPING_LIST_CHUNK_SIZE
+)
+from recipes.models import RecipeIngredient
+
+from .ingredients import get_catalog_version
+
+PDF_CHUNK_SIZE = 64 * 1024
+
+
+class ShoppingListRenderer(BaseRenderer):
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        # The list itself is streamed by the view, only error payloads
+        # ever reach the renderer.
+        return json.dumps(data, ensure_ascii=False).encode('utf-8')
+
+
+class TxtShoppingListRenderer(ShoppingListRenderer):
+    media_type = 'text/plain'
+    format = 'txt'
+
+
+class CsvShoppingListRenderer(ShoppingListRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+
+class PdfShoppingListRenderer(ShoppingListRenderer):
+    media_type = 'application/pdf'
+    format = 'pdf'
+    charset = None
+
+
+SHOPPING_LIST_RENDERERS = [
+    TxtShoppingListRenderer,
+    CsvShoppingListRenderer,
+    PdfShoppingListRenderer,
+]
+
+
+class ShoppingListNegotiation(DefaultContentNegotiation):
+    # The format comes from ?format= only, the Accept header is ignored.
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        format_query = format_suffix or request.query_params.get(
+            self.settings.URL_FORMAT_OVERRIDE
+        )
+        if format_query:
+            renderers = self.filter_renderers(renderers, format_query)
+        return renderers[0], renderers[0].media_type
+
+
+def get_shopping_list_queryset(user):
+    return RecipeIngredient.objects.filter(
+        recipe__shopping_cart__user=user
+    ).values(
+        'ingredient__name',
+        'ingredient__measurement_unit'
+    ).annotate(
+        total_amount=Sum('amount'),
+        recipes=ArrayAgg(
+            Concat(
+                Value('"'), 'recipe__name',
+                Value('" (автор: '), 'recipe__author__username',
+                Value(')')
+            ),
+            distinct=True
+        )
+    ).order_by('ingredient__name', 'ingredient__measurement_unit')
+
+
+def iter_shopping_list_rows(user):
+    # DISABLE_SERVER_SIDE_CURSORS is set, so iterator() would still
+    # fetch the whole result at once. The list is read in keyset chunks
+    # after the last (name, unit) pair instead.
+    queryset = get_shopping_list_queryset(user)
+    chunk = list(queryset[:SHOPPING_LIST_CHUNK_SIZE])
+    while chunk:
+        yield from chunk
+        if len(chunk) < SHOPPING_LIST_CHUNK_SIZE:
+            return
+        name = chunk[-1]['ingredient__name']
+        unit = chunk[-1]['ingredient__measurement_unit']
+        chunk = list(queryset.filter(
+            Q(ingredient__name__gt=name)
+            | Q(ingredient__name=name, ingredient__measurement_unit__gt=unit)
+        )[:SHOPPING_LIST_CHUNK_SIZE])
+
+
+def iter_shopping_list(user):
+    for idx, item in enumerate(iter_shopping_list_rows(user), 1):
+        yield (
+            idx,
+            item['ingredient__name'].capitalize(),
+            item['ingredient__measurement_unit'],
+            item['total_amount'],
+            ', '.join(sorted(item['recipes'])),
+        )
+
+
+def _header_lines():
+    date_str = datetime.now().strftime('%d.%m.%Y %H:%M')
+    return ['Список покупок', f'Дата составления: {date_str}', '']
+
+
+def txt_header():
+    return '\n'.join(_header_lines()) + '\n'
+
+
+def stream_txt(rows):
+    empty = True
+    for idx, name, unit, amount, recipes in rows:
+        if empty:
+            yield 'Товары:\n'
+            empty = False
+        yield f'{idx}. {name} ({unit}) — {amount}\n'
+        if recipes:
+            yield f'   Рецепты: {recipes}\n'
+    if empty:
+        yield 'Ваш список пуст.\n'
+
+
+class _Echo:
+
+    def write(self, value):
+        return value
+
+
+def stream_csv(rows):
+    writer = csv.writer(_Echo())
+    # The BOM makes Excel open the file as UTF-8.
+    yield '\ufeff' + writer.writerow(
+        ['№', 'Продукт', 'Единица измерения', 'Количество', 'Рецепты']
+    )
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def stream_pdf(rows):
+    # fpdf builds the whole document in memory, so the PDF is only sent
+    # in chunks once it is complete; the query is still read in chunks.
+    pdf = FPDF()
+    pdf.add_font('DejaVu', '', settings.SHOPPING_LIST_PDF_FONT, uni=True)
+    pdf.set_font('DejaVu', size=12)
+    pdf.add_page()
+    for line in _header_lines():
+        pdf.cell(0, 8, txt=line, ln=1)
+    empty = True
+    for idx, name, unit, amount, recipes in rows:
+        empty = False
+        pdf.multi_cell(0, 7, txt=f'{idx}. {name} ({unit}) — {amount}')
+        if recipes:
+            pdf.set_font_size(9)
+            pdf.multi_cell(0, 5, txt=f'Рецепты: {recipes}')
+            pdf.set_font_size(12)
+    if empty:
+        pdf.cell(0, 8, txt='Ваш список пуст.', ln=1)
+    content = pdf.output(dest='S').encode('latin-1')
+    for start in range(0, len(content), PDF_CHUNK_SIZE):
+        yield content[start:start + PDF_CHUNK_SIZE]
+
+
+SHOPPING_LIST_WRITERS = {
+    'txt': stream_txt,
+    'csv': stream_csv,
+    'pdf': stream_pdf,
+}
+
+# Formats whose body is cached. The date line is rendered for every
+# response and put in front of it; the PDF has the date inside the
+# document, so it is never cached.
+SHOPPING_LIST_HEADERS = {
+    'txt': txt_header,
+    'csv': str,
+}
+
+
+def stream_shopping_list(user, file_format):
+    return SHOPPING_LIST_WRITERS[file_format](iter_shopping_list(user))
+
+
+def bump_shopping_cart_version(users):
+    users.update(shopping_cart_version=F('shopping_cart_version') + 1)
+
+
+def _shopping_list_version(user):
+    # Ingredient names and units come from the catalog, which is not
+    # tracked by the cart version.
+    return f'{user.shopping_cart_version}-{get_catalog_version()}'
+
+
+def get_shopping_list_cache_key(user, file_format):
+    return (
+        f'shopping_list:{user.pk}:{_shopping_list_version(user)}:'
+        f'{file_format}'
+    )
+
+
+def get_shopping_list_etag(user, file_format):
+    # Weak, since the date line differs between responses.
+    return f'W/"{user.pk}-{_shopping_list_version(user)}-{file_format}"'
+
+
+def get_shopping_list_content(user, file_format):
+    # Returns the whole file when the body is cached, or an iterator of
+    # chunks to be streamed otherwise.
+    header = SHOPPING_LIST_HEADERS.get(file_format)
+    if header is None:
+        return stream_shopping_list(user, file_format)
+    cache_key = get_shopping_list_cache_key(user, file_format)
+    content = cache.get(cache_key)
+    if content is not None:
+        return header().encode('utf-8') + content
+    return chain([header()], cache_stream(
+        cache_key, stream_shopping_list(user, file_format)
+    ))
+
+
+def cache_stream(cache_key, chunks):
+    # Chunks are passed through as they are produced; the rendered file is
+    # kept for the cache only while it stays under the size limit.
+    buffer = []
+    size = 0
+    for chunk in chunks:
+        if buffer is not None:
+            data = chunk.encode('utf-8') if isinstance(chunk, str) else chunk
+            size += len(data)
+            if size > SHOPPING_LIST_CACHE_MAX_SIZE:
+                buffer = None
+            else:
+                buffer.append(data)
+        yield chunk
+    if buffer is not None:
+        cache.set(cache_key, b''.join(buffer), SHOPPING_LIST_CACHE_TIMEOUT)
@@ -0,0 +1,172 @@
+from django.contrib.auth import get_user_model
+from django.db.models import Q, QuerySet
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from recipes.counters import recount_ids
+from recipes.models import (
+    Favorite, Ingredient, Recipe, RecipeIngredient, ShoppingCart, Tag
+)
+from recipes.popularity import recount_popularity
+from users.models import Subscription
+
+from .imaging import renditions_stored
+from .ingredients import bump_catalog_version
+from .relations import relations_invalidated
+from .response_cache import author_changed, catalog_changed, recipes_changed
+from .shopping_list import bump_shopping_cart_version
+from .tags import bump_tags_version
+
+User = get_user_model()
+
+# User fields shown inside recipe responses. Saves limited to other fields,
+# such as last_login on sign in, leave cached recipes alone.
+AUTHOR_FIELDS = frozenset((
+    'email', 'username', 'first_name', 'last_name', 'avatar', 'avatar_url',
+    'avatar_renditions',
+))
+
+
+@receiver([post_save, post_delete], sender=Ingredient)
+def ingredient_changed(sender, **kwargs):
+    bump_catalog_version()
+    catalog_changed()
+
+
+@receiver([post_save, post_delete], sender=Tag)
+def tag_changed(sender, **kwargs):
+    bump_tags_version()
+    catalog_changed()
+
+
+def _deleted_with_author(origin):
+    # Recipes removed by the cascade of a user deletion are handled in bulk
+    # by user_deleted instead of once per recipe.
+    if isinstance(origin, QuerySet):
+        return origin.model is User
+    return isinstance(origin, User)
+
+
+@receiver([post_save, post_delete], sender=Recipe)
+def recipe_changed(sender, instance, origin=None, **kwargs):
+    # Ingredients and tags are written in the same transaction as the
+    # recipe, and the cached responses are dropped after it commits.
+    if not _deleted_with_author(origin):
+        recipes_changed([instance.pk])
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_saved(sender, instance, **kwargs):
+    # The shopping list shows recipe names and ingredient amounts. The API
+    # writes the ingredients in bulk after saving the recipe, so this also
+    # covers them.
+    bump_shopping_cart_version(
+        User.objects.filter(shopping_cart__recipe=instance)
+    )
+
+
+@receiver([post_save, post_delete], sender=RecipeIngredient)
+def recipe_ingredient_changed(sender, instance, origin=None, **kwargs):
+    # Rows removed with their recipe are covered by recipe_deleted.
+    if isinstance(origin, QuerySet):
+        origin = origin.model
+    elif origin is not None:
+        origin = type(origin)
+    if origin in (None, RecipeIngredient):
+        bump_shopping_cart_version(
+            User.objects.filter(shopping_cart__recipe=instance.recipe_id)
+        )
+
+
+@receiver(post_save, sender=User)
+def user_changed(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None or not AUTHOR_FIELDS.isdisjoint(update_fields):
+        author_changed(instance.pk)
+    # The author's username is part of the shopping list.
+    if update_fields is None or 'username' in update_fields:
+        bump_shopping_cart_version(
+            User.objects.filter(shopping_cart__recipe__author=instance)
+        )
+
+
+@receiver(renditions_stored)
+def renditions_changed(sender, pk, **kwargs):
+    if sender is Recipe:
+        recipes_changed([pk])
+    elif sender is User:
+        author_changed(pk)
+
+
+@receiver(pre_delete, sender=Recipe)
+def recipe_deleted(sender, instance, origin=None, **kwargs):
+    # Favorites and cart rows go with the recipe through the cascade,
+    # which bypasses the views that keep the cached id sets and the
+    # shopping list versions up to date. This also covers deletions from
+    # the admin.
+    if _deleted_with_author(origin):
+        return
+    bump_shopping_cart_version(
+        User.objects.filter(shopping_cart__recipe=instance)
+    )
+    relations_invalidated(
+        Favorite.objects.filter(recipe=instance).values_list(
+            'user_id', flat=True
+        ).union(ShoppingCart.objects.filter(recipe=instance).values_list(
+            'user_id', flat=True
+        ))
+    )
+    instance._recount = {
+        'users': [instance.author_id],
+        'ingredients': list(Ingredient.objects.filter(
+            ingredient_recipes__recipe=instance
+        ).values_list('pk', flat=True)),
+    }
+
+
+@receiver(pre_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    # Covers all of the author's recipes at once: one update of the cart
+    # versions, one query for the affected users and one for the recipes.
+    bump_shopping_cart_version(
+        User.objects.filter(shopping_cart__recipe__author=instance)
+    )
+    relations_invalidated(
+        Favorite.objects.filter(recipe__author=instance).values_list(
+            'user_id', flat=True
+        ).union(
+            ShoppingCart.objects.filter(recipe__author=instance).values_list(
+                'user_id', flat=True
+            ),
+            Subscription.objects.filter(author=instance).values_list(
+                'subscriber_id', flat=True
+            ),
+        )
+    )
+    recipes_changed(list(Recipe.objects.filter(
+        author=instance
+    ).values_list('pk', flat=True)))
+    # The user's favorites, cart entries and subscriptions go with them,
+    # so the counters on the other side are recounted after the cascade.
+    instance._recount = {
+        'users': set(User.objects.filter(
+            Q(subscriptions__author=instance)
+            | Q(subscribers__subscriber=instance)
+        ).values_list('pk', flat=True)),
+        'ingredients': set(Ingredient.objects.filter(
+            ingredient_recipes__recipe__author=instance
+        ).values_list('pk', flat=True)),
+        'recipes': set(Recipe.objects.filter(
+            Q(favorites__user=instance) | Q(shopping_cart__user=instance)
+        ).exclude(author=instance).values_list('pk', flat=True)),
+    }
+
+
+@receiver(post_delete, sender=Recipe)
+@receiver(post_delete, sender=User)
+def recount_after_delete(sender, instance, **kwargs):
+    # Every delete path ends here, the API as well as the admin, once the
+    # cascade has removed the related rows.
+    ids_by_name = getattr(instance, '_recount', None)
+    if ids_by_name:
+        recount_ids(ids_by_name)
+        recount_popularity(ids_by_name.get('recipes', ()))
@@ -0,0 +1,46 @@
+from constants import TAG_CACHE_TTL
+from recipes.models import Tag
+
+from .versioning import VersionedSnapshot, bump_versions, get_version
+
+TAGS_VERSION_KEY = 'tags:version'
+
+
+def get_tags_version():
+    return get_version(TAGS_VERSION_KEY)
+
+
+def bump_tags_version():
+    bump_versions([TAGS_VERSION_KEY])
+
+
+class TagCache(VersionedSnapshot):
+    # The tag table is tiny and read on every recipe list request, so each
+    # process keeps a copy and reloads it when the shared version changes.
+    version_key = TAGS_VERSION_KEY
+    ttl = TAG_CACHE_TTL
+    __slots__ = ()
+
+    def build(self):
+        rows = tuple(Tag.objects.values('id', 'name', 'color', 'slug'))
+        return (
+            rows,
+            {row['id']: row for row in rows},
+            {row['slug']: row['id'] for row in rows},
+        )
+
+    def all(self):
+        return list(self.load()[0])
+
+    def get(self, pk):
+        return self.load()[1].get(pk)
+
+    def slug_choices(self):
+        return [(slug, slug) for slug in self.load()[2]]
+
+    def ids_for_slugs(self, slugs):
+        ids = self.load()[2]
+        return [ids[slug] for slug in slugs if slug in ids]
+
+
+tag_cache = TagCache()
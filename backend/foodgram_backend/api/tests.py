@@ -0,0 +1,877 @@
+import base64
+import csv
+import json
+import random
+import shutil
+import tempfile
+import threading
+from datetime import datetime, timedelta
+from io import BytesIO, StringIO
+from itertools import islice, product
+from unittest import mock
+from urllib.parse import parse_qs, urlsplit
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection, connections
+from django.test import TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+from rest_framework.test import APIClient, APITestCase
+
+from recipes.models import (
+    Favorite, Ingredient, Recipe, RecipeIngredient, RecipePopularity,
+    ShoppingCart, Tag
+)
+from recipes.feed import fan_out_recipe
+from recipes.models import FeedEntry
+from recipes.popularity import refresh_popularity
+from users.models import Subscription
+
+from .pagination import RecipePagination
+from .relations import get_cached_ids
+from .shopping_list import get_shopping_list_queryset, iter_shopping_list_rows
+
+User = get_user_model()
+
+
+def create_user(username):
+    return User.objects.create_user(
+        username=username, email=f'{username}@example.com',
+        password='password', first_name=username, last_name=username
+    )
+
+
+def create_recipe(author, name, tags=(), ingredients=()):
+    recipe = Recipe.objects.create(
+        author=author, name=name, text='Описание', cooking_time=10,
+        image='recipes/test.png'
+    )
+    recipe.tags.set(tags)
+    RecipeIngredient.objects.bulk_create(
+        RecipeIngredient(recipe=recipe, ingredient=ingredient, amount=1)
+        for ingredient in ingredients
+    )
+    return recipe
+
+
+def collect_pages(client, url, params, max_pages=100):
+    # Follows the next links from the first keyset page and returns the
+    # ids of every page.
+    pages = []
+    response = client.get(url, {**params, 'cursor': ''})
+    for _ in range(max_pages):
+        if response.status_code != 200:
+            raise AssertionError(response.data)
+        pages.append([item['id'] for item in response.data['results']])
+        if response.data['next'] is None:
+            return pages
+        response = client.get(response.data['next'])
+    raise AssertionError(f'Больше {max_pages} страниц: {pages[:5]}')
+
+
+def encode_cursor(value):
+    return base64.urlsafe_b64encode(json.dumps(value).encode()).decode()
+
+
+class RecipeListQueriesTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('reader')
+        author = create_user('author')
+        tags = [
+            Tag.objects.create(name=name, color='#E26C2D', slug=name)
+            for name in ('breakfast', 'lunch')
+        ]
+        ingredients = [
+            Ingredient.objects.create(name=name, measurement_unit='г')
+            for name in ('соль', 'сахар')
+        ]
+        for number in range(60):
+            recipe = create_recipe(
+                author, f'Рецепт {number}', tags, ingredients
+            )
+            if number % 2:
+                Favorite.objects.create(user=cls.user, recipe=recipe)
+            if number % 3:
+                ShoppingCart.objects.create(user=cls.user, recipe=recipe)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_authenticate(self.user)
+        # The first request loads the tag cache and the relation sets.
+        self.client.get('/api/recipes/?limit=1')
+
+    def test_query_count_does_not_depend_on_page_size(self):
+        with CaptureQueriesContext(connection) as small_page:
+            response = self.client.get('/api/recipes/?limit=5')
+        self.assertEqual(len(response.data['results']), 5)
+        with self.assertNumQueries(len(small_page)):
+            response = self.client.get('/api/recipes/?limit=50')
+        self.assertEqual(len(response.data['results']), 50)
+
+
+class RecipeFilterTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('reader')
+        other_user = create_user('other')
+        cls.author = create_user('author')
+        other_author = create_user('other_author')
+        breakfast, lunch, dinner = (
+            Tag.objects.create(name=name, color='#E26C2D', slug=name)
+            for name in ('breakfast', 'lunch', 'dinner')
+        )
+        tag_sets = ([lunch], [breakfast, dinner], [breakfast, dinner],
+                    [dinner], [])
+        cls.expected = {
+            flags: set() for flags in product((False, True), repeat=2)
+        }
+        for number in range(40):
+            author = cls.author if number % 4 else other_author
+            recipe = create_recipe(
+                author, f'Рецепт {number}', tag_sets[number % 5]
+            )
+            favorited, in_cart = bool(number % 2), bool(number % 3)
+            for user in (cls.user, other_user):
+                if favorited:
+                    Favorite.objects.create(user=user, recipe=recipe)
+                if in_cart:
+                    ShoppingCart.objects.create(user=user, recipe=recipe)
+            if author == cls.author and number % 5 in (1, 2, 3):
+                cls.expected[favorited, in_cart].add(recipe.pk)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_authenticate(self.user)
+
+    def assert_combined_filters(self):
+        for favorited, in_cart in self.expected:
+            with self.subTest(is_favorited=favorited, is_in_cart=in_cart):
+                response = self.client.get('/api/recipes/', {
+                    'author': self.author.pk,
+                    'tags': ['breakfast', 'dinner'],
+                    'is_favorited': int(favorited),
+                    'is_in_shopping_cart': int(in_cart),
+                    'limit': 50,
+                })
+                self.assertEqual(response.status_code, 200)
+                ids = [recipe['id'] for recipe in response.data['results']]
+                self.assertEqual(len(ids), len(set(ids)))
+                self.assertEqual(set(ids), self.expected[favorited, in_cart])
+                self.assertEqual(response.data['count'], len(ids))
+
+    def test_combined_filters_return_each_recipe_once(self):
+        self.assert_combined_filters()
+
+    def test_combined_filters_without_cached_ids(self):
+        # Id sets above the limit are filtered with EXISTS instead.
+        with mock.patch('api.filters.RELATION_FILTER_MAX_IDS', 0):
+            self.assert_combined_filters()
+
+
+class DeleteCountersTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.reader = create_user('reader')
+        self.author = create_user('author')
+        self.ingredient = Ingredient.objects.create(
+            name='соль', measurement_unit='г'
+        )
+        self.recipe = create_recipe(
+            self.author, 'Рецепт', ingredients=[self.ingredient]
+        )
+        self.own_recipe = create_recipe(
+            self.reader, 'Свой рецепт', ingredients=[self.ingredient]
+        )
+        self.client.force_authenticate(self.reader)
+        for kind in ('favorite', 'shopping_cart'):
+            self.client.post(f'/api/recipes/{self.recipe.pk}/{kind}/')
+        self.client.post(f'/api/users/{self.author.pk}/subscribe/')
+        refresh_popularity()
+
+    def test_deleting_user_recounts_other_authors(self):
+        response = self.client.delete(
+            '/api/users/me/', {'current_password': 'password'}
+        )
+        self.assertEqual(response.status_code, 204)
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.favorites_count, 0)
+        self.assertEqual(self.recipe.shopping_cart_count, 0)
+        self.assertEqual(
+            RecipePopularity.objects.get(recipe=self.recipe).score_all, 0
+        )
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.followers_count, 0)
+        self.ingredient.refresh_from_db()
+        self.assertEqual(self.ingredient.recipes_count, 1)
+
+    def test_deleting_recipe_recounts_author_and_ingredients(self):
+        response = self.client.delete(f'/api/recipes/{self.own_recipe.pk}/')
+        self.assertEqual(response.status_code, 204)
+        self.reader.refresh_from_db()
+        self.assertEqual(self.reader.recipes_count, 0)
+        self.ingredient.refresh_from_db()
+        self.assertEqual(self.ingredient.recipes_count, 1)
+
+
+class AvatarDeleteTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = create_user('reader')
+        User.objects.filter(pk=self.user.pk).update(
+            avatar='users/test.png',
+            avatar_renditions={'webp': {'64': 'users/renditions/test-64.webp'}}
+        )
+        self.user.refresh_from_db()
+        self.client.force_authenticate(self.user)
+
+    def test_delete_clears_stored_renditions(self):
+        etag = self.client.get('/api/users/me/')['ETag']
+        version = self.user.version
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.delete('/api/users/me/avatar/')
+        self.assertEqual(response.status_code, 204)
+        user = User.objects.get(pk=self.user.pk)
+        self.assertFalse(user.avatar)
+        self.assertEqual(user.avatar_renditions, {})
+        self.assertEqual(user.version, version + 2)
+        self.assertNotEqual(self.client.get('/api/users/me/')['ETag'], etag)
+
+
+class ShoppingListTests(APITestCase):
+    url = '/api/recipes/download_shopping_cart/'
+
+    def setUp(self):
+        cache.clear()
+        self.user = create_user('reader')
+        self.author = create_user('author')
+        self.ingredient = Ingredient.objects.create(
+            name='соль', measurement_unit='г'
+        )
+        self.recipe = create_recipe(
+            self.author, 'Суп', ingredients=[self.ingredient]
+        )
+        ShoppingCart.objects.create(user=self.user, recipe=self.recipe)
+        self.client.force_authenticate(self.user)
+
+    def download(self, file_format='txt', **headers):
+        # Authentication normally loads the user for every request.
+        self.user.refresh_from_db()
+        return self.client.get(self.url, {'format': file_format}, **headers)
+
+    def content(self, response):
+        if response.streaming:
+            return b''.join(response.streaming_content).decode('utf-8')
+        return response.content.decode('utf-8')
+
+    def assert_changes(self, change, text):
+        response = self.download()
+        self.content(response)
+        change()
+        changed = self.download(HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed['ETag'], response['ETag'])
+        self.assertIn(text, self.content(changed))
+
+    def test_unchanged_list_is_not_modified(self):
+        response = self.download()
+        self.content(response)
+        self.assertEqual(
+            self.download(HTTP_IF_NONE_MATCH=response['ETag']).status_code,
+            304
+        )
+
+    def test_ingredient_rename_changes_list(self):
+        def change():
+            self.ingredient.name = 'перец'
+            self.ingredient.save()
+        self.assert_changes(change, 'Перец')
+
+    def test_amount_change_changes_list(self):
+        def change():
+            row = RecipeIngredient.objects.get(recipe=self.recipe)
+            row.amount = 7
+            row.save()
+        self.assert_changes(change, '— 7')
+
+    def test_recipe_rename_changes_list(self):
+        def change():
+            self.recipe.name = 'Борщ'
+            self.recipe.save()
+        self.assert_changes(change, '"Борщ"')
+
+    def test_author_rename_changes_list(self):
+        def change():
+            self.author.username = 'chef'
+            self.author.save()
+        self.assert_changes(change, '(автор: chef)')
+
+    def add_ingredients(self):
+        # Several units of the same name, so chunks end inside a name.
+        units = {'соль': ('г', 'кг', 'щепотка'), 'сахар': ('г', 'кг')}
+        ingredients = [
+            Ingredient.objects.get_or_create(
+                name=name, measurement_unit=unit
+            )[0]
+            for name, name_units in units.items() for unit in name_units
+        ]
+        recipe = create_recipe(self.author, 'Пирог', ingredients=ingredients)
+        ShoppingCart.objects.create(user=self.user, recipe=recipe)
+
+    def test_chunks_cover_every_row_once(self):
+        self.add_ingredients()
+        expected = list(get_shopping_list_queryset(self.user))
+        self.assertEqual(len(expected), 5)
+        for size in (1, 2, 3, 5):
+            with self.subTest(chunk_size=size), mock.patch(
+                'api.shopping_list.SHOPPING_LIST_CHUNK_SIZE', size
+            ):
+                # Bounded, so a cursor that stops moving fails the test.
+                self.assertEqual(list(islice(
+                    iter_shopping_list_rows(self.user), len(expected) + 1
+                )), expected)
+        salt = next(
+            row for row in expected
+            if row['ingredient__name'] == 'соль'
+            and row['ingredient__measurement_unit'] == 'г'
+        )
+        self.assertEqual(salt['total_amount'], 2)
+        self.assertEqual(len(salt['recipes']), 2)
+
+    def test_txt_format(self):
+        self.add_ingredients()
+        response = self.download('txt')
+        self.assertEqual(response['Content-Type'], 'text/plain; charset=utf-8')
+        self.assertIn('filename="shopping_list.txt"',
+                      response['Content-Disposition'])
+        lines = self.content(response).splitlines()
+        self.assertEqual(lines[0], 'Список покупок')
+        self.assertEqual(lines[3], 'Товары:')
+        self.assertEqual(
+            [line for line in lines if line[:1].isdigit()], [
+                '1. Сахар (г) — 1', '2. Сахар (кг) — 1', '3. Соль (г) — 2',
+                '4. Соль (кг) — 1', '5. Соль (щепотка) — 1',
+            ]
+        )
+        cached = self.download('txt')
+        self.assertFalse(cached.streaming)
+        self.assertEqual(self.content(cached).splitlines(), lines)
+
+    def test_csv_format(self):
+        self.add_ingredients()
+        response = self.download('csv')
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        content = self.content(response)
+        self.assertTrue(content.startswith('\ufeff'))
+        rows = list(csv.reader(StringIO(content.lstrip('\ufeff'))))
+        self.assertEqual(rows[0][:4], [
+            '№', 'Продукт', 'Единица измерения', 'Количество'
+        ])
+        self.assertEqual(rows[3][:4], ['3', 'Соль', 'г', '2'])
+        self.assertEqual(rows[3][4], '"Пирог" (автор: author), '
+                                     '"Суп" (автор: author)')
+        self.assertEqual(len(rows), 6)
+
+    def test_pdf_format(self):
+        self.add_ingredients()
+        for _ in range(2):
+            response = self.download('pdf')
+            self.assertEqual(response['Content-Type'], 'application/pdf')
+            # The PDF carries its date, so it is rendered every time.
+            self.assertTrue(response.streaming)
+            content = b''.join(response.streaming_content)
+            self.assertTrue(content.startswith(b'%PDF'))
+
+    def test_empty_list(self):
+        ShoppingCart.objects.all().delete()
+        self.assertIn('Ваш список пуст.', self.content(self.download()))
+        rows = list(csv.reader(StringIO(self.content(self.download('csv')))))
+        self.assertEqual(len(rows), 1)
+
+    def test_cached_list_shows_current_date(self):
+        with mock.patch('api.shopping_list.datetime') as clock:
+            for day in (1, 2):
+                clock.now.return_value = datetime(2024, 5, day, 12, 0)
+                content = self.content(self.download())
+                self.assertIn(f'Дата составления: 0{day}.05.2024', content)
+                self.assertIn('Соль (г) — 1', content)
+
+
+class ResponseCacheStatsTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_each_response_is_logged(self):
+        with self.assertLogs('api.response_cache', 'INFO') as logs:
+            self.client.get('/api/recipes/')
+            self.client.get('/api/recipes/')
+        outcomes = [
+            line.split('outcome=')[1].split()[0] for line in logs.output
+        ]
+        self.assertEqual(outcomes, ['miss', 'hit'])
+        self.assertIn('kind=list', logs.output[0])
+
+    def test_command_refuses_process_local_cache(self):
+        with self.assertRaises(CommandError):
+            call_command('response_cache_stats')
+
+    def test_command_reports_shared_cache(self):
+        self.client.get('/api/recipes/')
+        with mock.patch(
+            'api.management.commands.response_cache_stats.stats_are_shared',
+            return_value=True
+        ):
+            output = StringIO()
+            call_command('response_cache_stats', stdout=output)
+        self.assertIn('list: запросов 1', output.getvalue())
+
+
+class KeysetPaginationTests(APITestCase):
+    INVALID_CURSORS = (
+        'не курсор',
+        base64.urlsafe_b64encode(b'not json').decode(),
+        encode_cursor(['2024-01-01T00:00:00+00:00']),
+        encode_cursor(['вчера', 1]),
+        encode_cursor(['2024-01-01T00:00:00+00:00', 'один']),
+    )
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('reader')
+        cls.authors = [create_user(f'author{number}') for number in range(7)]
+        recipes = [
+            create_recipe(cls.authors[number], f'Рецепт {number}')
+            for number in range(7)
+        ]
+        # Pairs of recipes and subscriptions share their date, so pages
+        # have to be split inside a group of ties.
+        now = timezone.now()
+        for number, recipe in enumerate(recipes):
+            Recipe.objects.filter(pk=recipe.pk).update(
+                pub_date=now - timedelta(days=number // 2)
+            )
+            Subscription.objects.create(
+                subscriber=cls.user, author=cls.authors[number]
+            )
+        Subscription.objects.filter(subscriber=cls.user).update(
+            subscription_date=now
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_authenticate(self.user)
+
+    def assert_pages(self, url, expected):
+        for limit in (1, 2, 3, len(expected)):
+            with self.subTest(url=url, limit=limit):
+                pages = collect_pages(self.client, url, {'limit': limit})
+                self.assertTrue(all(len(page) <= limit for page in pages))
+                self.assertEqual(sum(pages, []), expected)
+
+    def test_recipe_pages_cover_every_recipe_once(self):
+        self.assert_pages('/api/recipes/', list(Recipe.objects.order_by(
+            '-pub_date', '-id'
+        ).values_list('pk', flat=True)))
+
+    def test_subscription_pages_cover_every_author_once(self):
+        self.assert_pages('/api/users/subscriptions/', list(
+            Subscription.objects.filter(subscriber=self.user).order_by(
+                '-id'
+            ).values_list('author_id', flat=True)
+        ))
+
+    def test_feed_pages_cover_every_recipe_once(self):
+        self.assert_pages('/api/recipes/feed/', list(Recipe.objects.order_by(
+            '-pub_date', '-id'
+        ).values_list('pk', flat=True)))
+
+    def test_next_link_round_trips_cursor(self):
+        response = self.client.get('/api/recipes/', {'cursor': '', 'limit': 2})
+        last = Recipe.objects.get(pk=response.data['results'][-1]['id'])
+        paginator = RecipePagination()
+        self.assertEqual(
+            paginator.decode_cursor(paginator.encode_cursor(
+                (last.pub_date, last.pk)
+            )),
+            (last.pub_date, last.pk)
+        )
+        cursor = parse_qs(urlsplit(response.data['next']).query)['cursor']
+        self.assertEqual(
+            paginator.decode_cursor(cursor[0]), (last.pub_date, last.pk)
+        )
+
+    def test_invalid_cursor_is_not_found(self):
+        for url in ('/api/recipes/', '/api/users/subscriptions/',
+                    '/api/recipes/feed/'):
+            for cursor in self.INVALID_CURSORS:
+                with self.subTest(url=url, cursor=cursor):
+                    response = self.client.get(url, {'cursor': cursor})
+                    self.assertEqual(response.status_code, 404)
+
+    def test_page_numbers_without_cursor(self):
+        response = self.client.get('/api/recipes/', {'page': 2, 'limit': 3})
+        self.assertEqual(response.data['count'], 7)
+        self.assertIsNotNone(response.data['previous'])
+
+
+class ConditionalGetTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = create_user('reader')
+        self.author = create_user('author')
+        self.tag = Tag.objects.create(
+            name='Завтрак', color='#E26C2D', slug='breakfast'
+        )
+        self.ingredient = Ingredient.objects.create(
+            name='соль', measurement_unit='г'
+        )
+        self.recipe = create_recipe(
+            self.author, 'Суп', [self.tag], [self.ingredient]
+        )
+        self.recipe_url = f'/api/recipes/{self.recipe.pk}/'
+        self.author_url = f'/api/users/{self.author.pk}/'
+        self.client.force_authenticate(self.user)
+
+    def assert_changes(self, url, change):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        with self.captureOnCommitCallbacks(execute=True):
+            change()
+        changed = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed['ETag'], response['ETag'])
+
+    def save(self, instance, **fields):
+        def change():
+            for name, value in fields.items():
+                setattr(instance, name, value)
+            instance.save()
+        return change
+
+    def post(self, url):
+        return lambda: self.client.post(url)
+
+    def test_unchanged_representation_is_not_modified(self):
+        for url in (self.recipe_url, self.author_url):
+            response = self.client.get(url)
+            for headers in (
+                {'HTTP_IF_NONE_MATCH': response['ETag']},
+                {'HTTP_IF_MODIFIED_SINCE': response['Last-Modified']},
+            ):
+                with self.subTest(url=url, headers=headers):
+                    self.assertEqual(
+                        self.client.get(url, **headers).status_code, 304
+                    )
+
+    def test_recipe_changes_move_etag(self):
+        changes = {
+            'recipe': self.save(self.recipe, name='Борщ'),
+            'author': self.save(self.author, first_name='Повар'),
+            'tag': self.save(self.tag, name='Обед'),
+            'ingredient': self.save(self.ingredient, name='перец'),
+            'favorite': self.post(f'{self.recipe_url}favorite/'),
+            'shopping_cart': self.post(f'{self.recipe_url}shopping_cart/'),
+            'subscription': self.post(f'{self.author_url}subscribe/'),
+        }
+        for name, change in changes.items():
+            with self.subTest(change=name):
+                self.assert_changes(self.recipe_url, change)
+
+    def test_author_changes_move_etag(self):
+        changes = {
+            'author': self.save(self.author, last_name='Повар'),
+            'subscription': self.post(f'{self.author_url}subscribe/'),
+        }
+        for name, change in changes.items():
+            with self.subTest(change=name):
+                self.assert_changes(self.author_url, change)
+
+
+def make_image(size=(32, 24), file_format='PNG'):
+    output = BytesIO()
+    Image.new('RGB', size, 'red').save(output, file_format)
+    return output.getvalue()
+
+
+class ImageUploadTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.user = create_user('author')
+        self.recipe = create_recipe(self.user, 'Суп')
+        self.client.force_authenticate(self.user)
+        self.uploads = {
+            'avatar': '/api/users/me/avatar/',
+            'image': f'/api/recipes/{self.recipe.pk}/image/',
+        }
+
+    def raw(self, field, content, content_type='image/png'):
+        return self.client.generic(
+            'PUT', self.uploads[field], content, content_type=content_type
+        )
+
+    def multipart(self, field, content, name='upload.png'):
+        return self.client.put(self.uploads[field], {
+            field: SimpleUploadedFile(name, content)
+        }, format='multipart')
+
+    def base64(self, field, content, prefix='data:image/png;base64,'):
+        return self.client.put(self.uploads[field], {
+            field: prefix + base64.b64encode(content).decode()
+        }, format='json')
+
+    def test_image_is_accepted_in_every_encoding(self):
+        for field in self.uploads:
+            for upload in (self.raw, self.multipart, self.base64):
+                with self.subTest(field=field, upload=upload.__name__):
+                    response = upload(field, make_image())
+                    self.assertEqual(response.status_code, 200, response.data)
+                    self.assertTrue(response.data[field].endswith('.png'))
+
+    def test_file_type_comes_from_content(self):
+        # A JPEG sent with a PNG name and content type is stored as JPEG.
+        response = self.multipart(
+            'avatar', make_image(file_format='JPEG'), name='photo.png'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['avatar'].endswith('.jpg'))
+
+    def test_non_image_is_rejected(self):
+        content = b'%PDF-1.4 not an image'
+        for field in self.uploads:
+            for upload in (self.raw, self.multipart, self.base64):
+                with self.subTest(field=field, upload=upload.__name__):
+                    response = upload(field, content)
+                    self.assertEqual(response.status_code, 400)
+                    self.assertIn(field, response.data)
+
+    def test_too_small_image_is_rejected(self):
+        response = self.raw('avatar', make_image(size=(8, 8)))
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('avatar', response.data)
+
+    def test_raw_body_needs_image_content_type(self):
+        response = self.raw('avatar', make_image(), 'text/plain')
+        self.assertEqual(response.status_code, 415)
+
+
+@mock.patch('recipes.feed.FEED_FANOUT_THRESHOLD', 2)
+class FeedTests(APITestCase):
+    # With the threshold at 2, an author with up to two followers is
+    # fanned out and one with more is pulled when the feed is read.
+
+    def setUp(self):
+        cache.clear()
+        self.reader = create_user('reader')
+        self.others = [create_user(f'other{number}') for number in range(3)]
+        self.small, self.big, self.unfollowed = (
+            create_user(name) for name in ('small', 'big', 'unfollowed')
+        )
+        self.start = timezone.now() - timedelta(days=1)
+        self.minutes = 0
+        for user in (self.reader, *self.others):
+            self.subscribe(user, self.big)
+        self.subscribe(self.reader, self.small)
+        self.client.force_authenticate(self.reader)
+
+    def subscribe(self, user, author, method='post'):
+        client = APIClient()
+        client.force_authenticate(user)
+        response = getattr(client, method)(
+            f'/api/users/{author.pk}/subscribe/'
+        )
+        self.assertLess(response.status_code, 300)
+
+    def publish(self, author, count=2):
+        # Every other recipe shares its date with the previous one, so the
+        # pages also split inside groups of ties across both sources.
+        for _ in range(count):
+            recipe = create_recipe(author, f'Рецепт {self.minutes}')
+            Recipe.objects.filter(pk=recipe.pk).update(
+                pub_date=self.start + timedelta(minutes=self.minutes // 2)
+            )
+            self.minutes += 1
+            fan_out_recipe(Recipe.objects.select_related('author').get(
+                pk=recipe.pk
+            ))
+
+    def assert_feed(self, authors):
+        expected = list(Recipe.objects.filter(author__in=authors).order_by(
+            '-pub_date', '-id'
+        ).values_list('pk', flat=True))
+        for limit in (1, 2, 3, 5, len(expected) + 1):
+            with self.subTest(limit=limit):
+                pages = collect_pages(
+                    self.client, '/api/recipes/feed/', {'limit': limit}
+                )
+                self.assertTrue(all(len(page) <= limit for page in pages))
+                self.assertEqual(sum(pages, []), expected)
+
+    def test_pages_merge_entries_and_pulled_recipes(self):
+        for _ in range(3):
+            self.publish(self.small)
+            self.publish(self.big)
+            self.publish(self.unfollowed)
+        self.assertTrue(FeedEntry.objects.filter(user=self.reader).exists())
+        self.assertFalse(Recipe.objects.filter(
+            author=self.big, fanned_out=True
+        ).exists())
+        self.assert_feed([self.small, self.big])
+
+    def test_pages_after_crossing_threshold(self):
+        self.publish(self.small, 3)
+        self.publish(self.big, 3)
+        # small rises above the threshold and big drops below it, so each
+        # has recipes on both sides.
+        for user in self.others:
+            self.subscribe(user, self.small)
+        self.subscribe(self.others[0], self.big, 'delete')
+        self.subscribe(self.others[1], self.big, 'delete')
+        self.publish(self.small, 3)
+        self.publish(self.big, 3)
+        for author in (self.small, self.big):
+            self.assertEqual(set(Recipe.objects.filter(
+                author=author
+            ).values_list('fanned_out', flat=True)), {False, True})
+        self.assert_feed([self.small, self.big])
+
+    def test_subscription_changes_feed(self):
+        self.publish(self.small, 3)
+        self.publish(self.unfollowed, 3)
+        self.subscribe(self.reader, self.unfollowed)
+        self.assert_feed([self.small, self.big, self.unfollowed])
+        self.subscribe(self.reader, self.small, 'delete')
+        self.assert_feed([self.big, self.unfollowed])
+
+
+class BenchmarkTagFilterTests(APITestCase):
+
+    def setUp(self):
+        Tag.objects.create(name='Завтрак', color='#E26C2D', slug='breakfast')
+
+    def benchmark(self, *args):
+        output = StringIO()
+        call_command(
+            'benchmark_tag_filter', '--queries', '2', *args, stdout=output
+        )
+        return output.getvalue()
+
+    def test_generate_needs_allow_writes(self):
+        with self.assertRaises(CommandError):
+            self.benchmark('--generate', '5')
+        self.assertFalse(Recipe.objects.exists())
+
+    def test_generated_recipes_are_rolled_back(self):
+        output = self.benchmark('--generate', '5', '--allow-writes')
+        self.assertIn('Рецептов в базе: 5', output)
+        self.assertFalse(Recipe.objects.exists())
+
+    def test_generated_recipes_are_kept_on_request(self):
+        self.benchmark('--generate', '5', '--allow-writes', '--keep')
+        self.assertEqual(Recipe.objects.count(), 5)
+
+
+class ConcurrentRelationsTests(TransactionTestCase):
+    # Real transactions, so on_commit callbacks run and the requests of
+    # different threads really race each other.
+    THREADS = 6
+    REQUESTS = 40
+
+    def setUp(self):
+        cache.clear()
+        self.users = [create_user(f'reader{number}') for number in range(2)]
+        self.authors = [
+            create_user(f'author{number}') for number in range(3)
+        ]
+        self.recipes = [
+            create_recipe(self.authors[number % 3], f'Рецепт {number}')
+            for number in range(6)
+        ]
+
+    def tearDown(self):
+        cache.clear()
+
+    def worker(self, seed, statuses):
+        rng = random.Random(seed)
+        client = APIClient()
+        client.force_authenticate(rng.choice(self.users))
+        try:
+            for _ in range(self.REQUESTS):
+                kind = rng.choice(('favorite', 'shopping_cart', 'subscribe'))
+                if kind == 'subscribe':
+                    url = (
+                        f'/api/users/{rng.choice(self.authors).pk}/subscribe/'
+                    )
+                else:
+                    url = f'/api/recipes/{rng.choice(self.recipes).pk}/{kind}/'
+                method = rng.choice((client.post, client.delete))
+                statuses.append(method(url).status_code)
+                if rng.random() < 0.3:
+                    statuses.append(
+                        client.get('/api/recipes/?is_favorited=1').status_code
+                    )
+        finally:
+            connections.close_all()
+
+    def test_concurrent_adds_and_removes_stay_consistent(self):
+        statuses = []
+        threads = [
+            threading.Thread(target=self.worker, args=(seed, statuses))
+            for seed in range(self.THREADS)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # Every thread got through all of its requests.
+        self.assertGreaterEqual(len(statuses), self.THREADS * self.REQUESTS)
+        self.assertFalse([status for status in statuses if status >= 500])
+        relations = {
+            'favorites': (Favorite, 'user', 'recipe_id'),
+            'cart': (ShoppingCart, 'user', 'recipe_id'),
+            'following': (Subscription, 'subscriber', 'author_id'),
+        }
+        for user in self.users:
+            for name, (model, owner, field) in relations.items():
+                with self.subTest(user=user.username, relation=name):
+                    self.assertEqual(
+                        get_cached_ids(user.pk, name),
+                        set(model.objects.filter(
+                            **{owner: user}
+                        ).values_list(field, flat=True))
+                    )
+        for recipe in Recipe.objects.all():
+            with self.subTest(recipe=recipe.name):
+                self.assertEqual(
+                    recipe.favorites_count,
+                    Favorite.objects.filter(recipe=recipe).count()
+                )
+                self.assertEqual(
+                    recipe.shopping_cart_count,
+                    ShoppingCart.objects.filter(recipe=recipe).count()
+                )
+        for user in User.objects.all():
+            with self.subTest(user=user.username):
+                self.assertEqual(
+                    user.followers_count,
+                    Subscription.objects.filter(author=user).count()
+                )
+                self.assertEqual(
+                    user.following_count,
+                    Subscription.objects.filter(subscriber=user).count()
+                )
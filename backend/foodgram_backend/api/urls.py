@@ -5,6 +5,7 @@ from .views import (
     UserViewSet,
     IngredientViewSet,
     RecipeViewSet,
+    TagViewSet,
 )
 
 router_v1 = DefaultRouter()
@@ -15,6 +16,12 @@ router_v1.register(
     basename='users'
 )
 
+router_v1.register(
+    r'tags',
+    TagViewSet,
+    basename='tags'
+)
+
 router_v1.register(
     r'ingredients',
     IngredientViewSet,
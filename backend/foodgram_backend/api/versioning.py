@@ -0,0 +1,62 @@
+import threading
+import time
+
+from django.core.cache import cache
+
+
+def get_versions(keys, timeout=None):
+    # Versions are timestamps, so a key that expired or was evicted never
+    # comes back with a value that older cached data was stored under.
+    versions = cache.get_many(keys)
+    missing = [key for key in keys if key not in versions]
+    if missing:
+        now = time.time_ns()
+        for key in missing:
+            cache.add(key, now, timeout)
+        versions.update(cache.get_many(missing))
+    return [versions.get(key, 0) for key in keys]
+
+
+def get_version(key, timeout=None):
+    return get_versions([key], timeout)[0]
+
+
+def bump_versions(keys, timeout=None):
+    cache.set_many(dict.fromkeys(keys, time.time_ns()), timeout)
+
+
+class VersionedSnapshot:
+    # A per-process copy of a small table, rebuilt by build() when the
+    # shared version_key changes or ttl seconds have passed. build()
+    # returns the whole snapshot as one object, so readers never see a
+    # half-built one.
+    version_key = None
+    ttl = None
+    __slots__ = ('_data', '_version', '_loaded_at', '_lock')
+
+    def __init__(self):
+        self._data = None
+        self._version = None
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    def build(self):
+        raise NotImplementedError
+
+    def _is_fresh(self, version):
+        return (
+            self._loaded_at is not None
+            and self._version == version
+            and time.monotonic() - self._loaded_at < self.ttl
+        )
+
+    def load(self):
+        version = get_version(self.version_key)
+        if self._is_fresh(version):
+            return self._data
+        with self._lock:
+            if not self._is_fresh(version):
+                self._data = self.build()
+                self._version = version
+                self._loaded_at = time.monotonic()
+        return self._data
@@ -1,14 +1,16 @@
 from django.contrib.auth import get_user_model
-from django.http import Http404, HttpResponse, FileResponse
+from django.http import Http404, HttpResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, redirect
-from django.db.models import Sum
+from django.db import IntegrityError, transaction
+from django.db.models import Exists, F, OuterRef, Prefetch, Value
+from django.utils.cache import get_conditional_response
 from django.views import View
 
 from rest_framework import (
-    status, viewsets, permissions, filters
+    status, viewsets, permissions
 )
 from rest_framework.decorators import action
-from rest_framework.parsers import JSONParser
+from rest_framework.filters import OrderingFilter
 from rest_framework.response import Response
 
 from djoser.views import UserViewSet as DjoserUserViewSet
@@ -16,12 +18,21 @@ from djoser.permissions import CurrentUserOrAdminOrReadOnly
 
 from django_filters.rest_framework import DjangoFilterBackend
 
+from constants import (
+    INGREDIENT_CATALOG_MAX_AGE, RESPONSE_CACHE_LIST_TIMEOUT,
+    RESPONSE_CACHE_TIMEOUT
+)
+
+from recipes.counters import change_counter
+from recipes.feed import backfill_feed, remove_from_feed
+from recipes.popularity import POPULARITY_PERIODS
 from recipes.models import (
     Ingredient,
     Recipe,
     Favorite,
     ShoppingCart,
     RecipeIngredient,
+    Tag,
 )
 from users.models import Subscription
 
@@ -29,41 +40,126 @@ from .serializers import (
     RecipeShortSerializer,
     UserSerializer,
     AvatarSerializer,
+    RecipeImageSerializer,
     IngredientSerializer,
+    TagSerializer,
     RecipeCreateUpdateSerializer,
     RecipeDetailSerializer,
     AuthorWithRecipesSerializer,
 )
+from .pagination import (
+    CustomPageNumberPagination,
+    FeedPagination,
+    RecipePagination,
+    SubscriptionPagination,
+)
 from .permissions import IsAuthorOrReadOnly
-from .filters import RecipeCustomFilter, IngredientNameSearchFilter
-from .utils import generate_shopping_list_content
+from .conditional import (
+    conditional_response, recipe_validators, user_validators
+)
+from .filters import RecipeCustomFilter, RecipeSearchFilter
+from .imaging import image_pipeline
+from .parsers import IMAGE_UPLOAD_PARSERS, get_image_data
+from .relations import MODEL_RELATIONS, relations_changed
+from .response_cache import (
+    CATALOG_GENERATION_KEY, LIST_GENERATION_KEY, cached_response,
+    recipe_generation_key
+)
+from .ingredients import ingredient_index, parse_accept_encoding
+from .tags import tag_cache
+from .shopping_list import (
+    SHOPPING_LIST_RENDERERS,
+    ShoppingListNegotiation,
+    bump_shopping_cart_version,
+    get_shopping_list_content,
+    get_shopping_list_etag,
+)
+from .utils import get_recipes_limit
 
 
 User = get_user_model()
 
 
+def get_recipe_queryset(user):
+    # search_vector is only read by the database when filtering, so the
+    # tsvector is never sent to Python.
+    queryset = Recipe.objects.select_related('author').prefetch_related(
+        'tags',
+        Prefetch(
+            'recipe_ingredients',
+            queryset=RecipeIngredient.objects.select_related('ingredient')
+        )
+    ).defer('search_vector')
+    if not user.is_authenticated:
+        return queryset
+    return queryset.annotate(
+        is_favorited=Exists(Favorite.objects.filter(
+            user=user, recipe=OuterRef('pk')
+        )),
+        is_in_cart=Exists(ShoppingCart.objects.filter(
+            user=user, recipe=OuterRef('pk')
+        )),
+        is_author_subscribed=Exists(Subscription.objects.filter(
+            subscriber=user, author=OuterRef('author')
+        )),
+    )
+
+
 class UserViewSet(DjoserUserViewSet):
 
     serializer_class = UserSerializer
     queryset = User.objects.all()
     permission_classes = [CurrentUserOrAdminOrReadOnly]
 
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        user = self.request.user
+        if not user.is_authenticated:
+            return queryset
+        return queryset.annotate(
+            is_subscribed=Exists(Subscription.objects.filter(
+                subscriber=user, author=OuterRef('pk')
+            ))
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        # Also serves GET /users/me/, which djoser routes through here.
+        if self.action == 'me':
+            pk = request.user.pk
+        else:
+            pk = kwargs.get(self.lookup_field, '')
+            if not pk.isdigit():
+                return super().retrieve(request, *args, **kwargs)
+            pk = int(pk)
+        validators = user_validators(request, pk)
+        if validators is None:
+            raise Http404
+        return conditional_response(
+            request, validators,
+            lambda: super(UserViewSet, self).retrieve(
+                request, *args, **kwargs
+            )
+        )
+
     @action(
         methods=['put', 'delete'],
         detail=False,
         url_path='me/avatar',
         permission_classes=[permissions.IsAuthenticated],
-        parser_classes=[JSONParser]
+        parser_classes=IMAGE_UPLOAD_PARSERS
     )
     def avatar(self, request, *args, **kwargs):
         current_user = request.user
         if request.method == 'PUT':
-            serializer = AvatarSerializer(current_user, data=request.data)
+            serializer = AvatarSerializer(
+                current_user, data=get_image_data(request, 'avatar')
+            )
             serializer.is_valid(raise_exception=True)
             serializer.save()
             response_serializer = AvatarSerializer(current_user, context={'request': request})
             return Response(response_serializer.data, status=status.HTTP_200_OK)
         if current_user.avatar:
+            image_pipeline.clear(current_user, 'avatar')
             current_user.avatar.delete(save=True)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
@@ -79,23 +175,77 @@ class UserViewSet(DjoserUserViewSet):
         if request.method == 'POST':
             if current_user == request_author:
                 return Response({'errors': 'Вы не можете подписываться на самого себя.'}, status=status.HTTP_400_BAD_REQUEST)
-            if Subscription.objects.filter(subscriber=current_user, author=request_author).exists():
-                return Response({'errors': 'Вы уже подписаны на этого пользователя.'}, status=status.HTTP_400_BAD_REQUEST)
-            Subscription.objects.create(subscriber=current_user, author=request_author)
+            already_subscribed = Response(
+                {'errors': 'Вы уже подписаны на этого пользователя.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+            if Subscription.objects.filter(
+                subscriber=current_user, author=request_author
+            ).exists():
+                return already_subscribed
+            # The unique constraint settles concurrent requests, so the
+            # counters only move for the one that inserted the row.
+            try:
+                with transaction.atomic():
+                    Subscription.objects.create(
+                        subscriber=current_user, author=request_author
+                    )
+                    self._change_subscription_counters(
+                        current_user, request_author, 1
+                    )
+                    backfill_feed(current_user, request_author)
+            except IntegrityError:
+                return already_subscribed
             response_serializer = AuthorWithRecipesSerializer(request_author, context={'request': request})
             return Response(response_serializer.data, status=status.HTTP_201_CREATED)
-        get_object_or_404(Subscription, subscriber=current_user, author=request_author).delete()
+        with transaction.atomic():
+            deleted, _ = Subscription.objects.filter(
+                subscriber=current_user, author=request_author
+            ).delete()
+            if not deleted:
+                raise Http404
+            self._change_subscription_counters(
+                current_user, request_author, -1
+            )
+            remove_from_feed(current_user, request_author)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
+    def _change_subscription_counters(self, subscriber, author, delta):
+        change_counter(
+            User.objects.filter(pk=author.pk), 'followers_count', delta
+        )
+        change_counter(
+            User.objects.filter(pk=subscriber.pk), 'following_count', delta
+        )
+        relations_changed([subscriber.pk], ['following'])
+
     @action(
         detail=False,
         methods=['get'],
         url_path='subscriptions',
-        permission_classes=[permissions.IsAuthenticated]
+        permission_classes=[permissions.IsAuthenticated],
+        pagination_class=SubscriptionPagination
     )
     def subscriptions(self, request):
         current_user = request.user
-        queryset = User.objects.filter(subscribers__subscriber=current_user).prefetch_related('recipe_author')
+        queryset = User.objects.filter(
+            subscribers__subscriber=current_user
+        ).annotate(
+            is_subscribed=Value(True),
+            subscription_date=F('subscribers__subscription_date'),
+            subscription_id=F('subscribers__id'),
+        ).order_by('-subscription_date', '-subscription_id').prefetch_related(
+            # A sliced Prefetch is rendered as ROW_NUMBER() OVER
+            # (PARTITION BY author_id), so only the top recipes_limit
+            # recipes of each author are fetched.
+            Prefetch(
+                'recipe_author',
+                queryset=Recipe.objects.defer(
+                    'search_vector'
+                )[:get_recipes_limit(request)],
+                to_attr='limited_recipes'
+            )
+        )
         page = self.paginate_queryset(queryset)
         serializer = AuthorWithRecipesSerializer(page if page is not None else queryset, many=True, context={'request': request})
         if page is not None:
@@ -109,8 +259,50 @@ class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
     serializer_class = IngredientSerializer
     permission_classes = [permissions.AllowAny]
     pagination_class = None
-    filter_backends = [IngredientNameSearchFilter]
-    search_fields = ['^name']
+
+    def list(self, request, *args, **kwargs):
+        name = request.query_params.get('name')
+        if name:
+            # Autocomplete is answered from the in-memory index: prefix
+            # matches first, then names containing the search term.
+            return Response(ingredient_index.search(name))
+        return self._catalog_response(request)
+
+    def _catalog_response(self, request):
+        encoding, etag, content = ingredient_index.catalog().get(
+            parse_accept_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        )
+        response = HttpResponse(content, content_type='application/json')
+        if encoding != 'identity':
+            response['Content-Encoding'] = encoding
+        response['ETag'] = etag
+        response['Vary'] = 'Accept-Encoding'
+        response['Cache-Control'] = (
+            f'public, max-age={INGREDIENT_CATALOG_MAX_AGE}'
+        )
+        return get_conditional_response(
+            request, etag=etag, response=response
+        )
+
+
+class TagViewSet(viewsets.ReadOnlyModelViewSet):
+
+    queryset = Tag.objects.all()
+    serializer_class = TagSerializer
+    permission_classes = [permissions.AllowAny]
+    pagination_class = None
+
+    def list(self, request, *args, **kwargs):
+        return Response(tag_cache.all())
+
+    def retrieve(self, request, pk=None, *args, **kwargs):
+        try:
+            tag = tag_cache.get(int(pk))
+        except ValueError:
+            tag = None
+        if tag is None:
+            raise Http404
+        return Response(tag)
 
 
 class RecipeViewSet(viewsets.ModelViewSet):
@@ -118,8 +310,42 @@ class RecipeViewSet(viewsets.ModelViewSet):
 
     queryset = Recipe.objects.all()
     permission_classes = [IsAuthorOrReadOnly]
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter]
+    pagination_class = RecipePagination
+    filter_backends = [DjangoFilterBackend, RecipeSearchFilter, OrderingFilter]
     filterset_class = RecipeCustomFilter
+    ordering_fields = ('pub_date', 'favorites_count', 'shopping_cart_count')
+
+    def get_queryset(self):
+        return get_recipe_queryset(self.request.user)
+
+    def list(self, request, *args, **kwargs):
+        # Counter-based ordering is not invalidated on every favorite, so
+        # cached lists live only briefly.
+        return cached_response(
+            request, 'list', [CATALOG_GENERATION_KEY, LIST_GENERATION_KEY],
+            RESPONSE_CACHE_LIST_TIMEOUT,
+            lambda: super(RecipeViewSet, self).list(request, *args, **kwargs)
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        pk = kwargs.get(self.lookup_field, '')
+        if not pk.isdigit():
+            return super().retrieve(request, *args, **kwargs)
+        pk = int(pk)
+        validators = recipe_validators(request, pk)
+        if validators is None:
+            raise Http404
+        return conditional_response(request, validators, lambda: (
+            cached_response(
+                request, 'detail',
+                [CATALOG_GENERATION_KEY, recipe_generation_key(pk)],
+                RESPONSE_CACHE_TIMEOUT,
+                lambda: super(RecipeViewSet, self).retrieve(
+                    request, *args, **kwargs
+                ),
+                etag=validators.etag
+            )
+        ))
 
     def get_serializer_class(self, *args, **kwargs):
 
@@ -128,6 +354,54 @@ class RecipeViewSet(viewsets.ModelViewSet):
             return RecipeCreateUpdateSerializer
         return RecipeDetailSerializer
 
+    @action(
+        detail=False,
+        methods=['get'],
+        pagination_class=CustomPageNumberPagination
+    )
+    def popular(self, request):
+        period = request.query_params.get('period', 'week')
+        score_field = POPULARITY_PERIODS.get(period)
+        if score_field is None:
+            periods = ', '.join(POPULARITY_PERIODS)
+            return Response(
+                {'errors': f'Период должен быть одним из: {periods}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        queryset = self.filter_queryset(self.get_queryset()).filter(
+            **{f'popularity__{score_field}__gt': 0}
+        ).order_by(f'-popularity__{score_field}', '-popularity__recipe')
+        page = self.paginate_queryset(queryset)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    @action(
+        detail=True,
+        methods=['put'],
+        url_path='image',
+        parser_classes=IMAGE_UPLOAD_PARSERS
+    )
+    def image(self, request, pk=None):
+        recipe = self.get_object()
+        serializer = RecipeImageSerializer(
+            recipe, data=get_image_data(request, 'image'),
+            context={'request': request}
+        )
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+    @action(
+        detail=False,
+        methods=['get'],
+        permission_classes=[permissions.IsAuthenticated],
+        pagination_class=FeedPagination
+    )
+    def feed(self, request):
+        page = self.paginate_queryset(self.get_queryset())
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
     @action(
         detail=True,
         methods=['post', 'delete'],
@@ -148,36 +422,72 @@ class RecipeViewSet(viewsets.ModelViewSet):
     def _manage_user_recipe_relation(self, request, pk, model):
         current_user = request.user
         recipe = get_object_or_404(Recipe, pk=pk)
-        relation_exists = model.objects.filter(user=current_user, recipe=recipe).exists()
         verbose_name_plural = model._meta.verbose_name_plural.lower()
+        # The insert or delete itself decides the outcome, so of several
+        # concurrent requests only the one that changed a row moves the
+        # counters and the caches.
         if request.method == 'POST':
-            if relation_exists:
-                return Response({'errors': f'Рецепт уже добавлен в {verbose_name_plural}'}, status=status.HTTP_400_BAD_REQUEST)
-            model.objects.create(user=current_user, recipe=recipe)
+            try:
+                with transaction.atomic():
+                    model.objects.create(user=current_user, recipe=recipe)
+                    self._relation_changed(current_user, recipe, model, 1)
+            except IntegrityError:
+                return Response(
+                    {'errors': f'Рецепт уже добавлен в {verbose_name_plural}'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
             response_serializer = RecipeShortSerializer(recipe, context={'request': request})
             return Response(response_serializer.data, status=status.HTTP_201_CREATED)
-        if not relation_exists:
-            return Response({'errors': f'Рецепта с таким ID нет в {verbose_name_plural}'}, status=status.HTTP_400_BAD_REQUEST)
-        model.objects.filter(user=current_user, recipe=recipe).delete()
+        with transaction.atomic():
+            deleted, _ = model.objects.filter(
+                user=current_user, recipe=recipe
+            ).delete()
+            if deleted:
+                self._relation_changed(current_user, recipe, model, -1)
+        if not deleted:
+            return Response(
+                {'errors': f'Рецепта с таким ID нет в {verbose_name_plural}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         return Response(status=status.HTTP_204_NO_CONTENT)
 
+    def _relation_changed(self, user, recipe, model, delta):
+        change_counter(
+            Recipe.objects.filter(pk=recipe.pk),
+            model.recipe_counter_field, delta
+        )
+        if model is ShoppingCart:
+            bump_shopping_cart_version(User.objects.filter(pk=user.pk))
+        relations_changed([user.pk], [MODEL_RELATIONS[model]])
+
     @action(
         detail=False,
         methods=['get'],
         url_path='download_shopping_cart',
-        permission_classes=[permissions.IsAuthenticated]
+        permission_classes=[permissions.IsAuthenticated],
+        renderer_classes=SHOPPING_LIST_RENDERERS,
+        content_negotiation_class=ShoppingListNegotiation
     )
     def download_shopping_cart(self, request):
         current_user = request.user
-        ingredients = RecipeIngredient.objects.filter(
-            recipe__shopping_cart__user=current_user
-        ).values(
-            'ingredient__name',
-            'ingredient__measurement_unit'
-        ).annotate(
-            total_amount=Sum('amount')
-        ).order_by('ingredient__name')
-        content = generate_shopping_list_content(ingredients)
-        response = FileResponse(content, content_type='text/plain; charset=utf-8')
-        response['Content-Disposition'] = 'attachment; filename="shopping_list.txt"'
+        renderer = request.accepted_renderer
+        etag = get_shopping_list_etag(current_user, renderer.format)
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified is not None:
+            return not_modified
+        content_type = renderer.media_type
+        if renderer.charset:
+            content_type = f'{content_type}; charset={renderer.charset}'
+        content = get_shopping_list_content(current_user, renderer.format)
+        if isinstance(content, bytes):
+            response = HttpResponse(content, content_type=content_type)
+        else:
+            response = StreamingHttpResponse(
+                content, content_type=content_type
+            )
+        response['ETag'] = etag
+        response['Cache-Control'] = 'private, no-cache'
+        response['Content-Disposition'] = (
+            f'attachment; filename="shopping_list.{renderer.format}"'
+        )
         return response
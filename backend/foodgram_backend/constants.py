@@ -6,3 +6,27 @@ MIN_COOKING_TIME_VALUE = 1
 MIN_AMOUNT_VALUE = 1
 DEFAULT_PAGE_SIZE = 10
 MAX_PAGE_SIZE = 100
+DEFAULT_RECIPES_LIMIT = 3
+SHOPPING_LIST_CHUNK_SIZE = 500
+SHOPPING_LIST_CACHE_TIMEOUT = 60 * 60 * 24
+SHOPPING_LIST_CACHE_MAX_SIZE = 1024 * 1024
+INGREDIENT_INDEX_TTL = 60 * 5
+INGREDIENT_CATALOG_MAX_AGE = 60 * 60 * 24
+POPULARITY_BATCH_SIZE = 1000
+FEED_FANOUT_THRESHOLD = 1000
+FEED_BATCH_SIZE = 1000
+RECIPE_IMAGE_WIDTHS = (320, 640, 1280)
+AVATAR_IMAGE_WIDTHS = (64, 128, 256)
+IMAGE_MIN_SIDE = 16
+IMAGE_MAX_SIDE = 8000
+IMAGE_MAX_PIXELS = 40_000_000
+IMAGE_WORKERS = 2
+TAG_NAME_MAX_LENGTH = 32
+TAG_COLOR_MAX_LENGTH = 7
+TAG_SLUG_MAX_LENGTH = 32
+TAG_CACHE_TTL = 60 * 5
+RELATION_CACHE_TIMEOUT = 60 * 60
+RELATION_FILTER_MAX_IDS = 500
+RESPONSE_CACHE_TIMEOUT = 60 * 60
+RESPONSE_CACHE_LIST_TIMEOUT = 60
+RESPONSE_CACHE_MAX_AGE = 30
@@ -1,14 +1,69 @@
 from django.contrib import admin
+from django.db.models import Prefetch
 from django.utils.html import format_html, mark_safe
 
+from .counters import recount_ids
 from .models import (
-    Ingredient, Recipe, RecipeIngredient, Favorite, ShoppingCart
+    Ingredient, Recipe, RecipeIngredient, Favorite, ShoppingCart, Tag
 )
+from .popularity import recount_popularity
 
 
 class BaseAdminSettings(admin.ModelAdmin):
     empty_value_display = '-пусто-'
     list_per_page = 20
+    # Skips the extra COUNT(*) over the whole table on every page.
+    show_full_result_count = False
+
+
+class InputFilter(admin.SimpleListFilter):
+    # A text box instead of a list of choices, so the sidebar does not
+    # load every related row.
+    template = 'admin/input_filter.html'
+    lookup = None
+
+    def lookups(self, request, model_admin):
+        # The filter is only rendered when it has at least one lookup.
+        return ((),)
+
+    def choices(self, changelist):
+        all_choice = next(super().choices(changelist))
+        all_choice['query_parts'] = (
+            (key, value)
+            for key, value in changelist.get_filters_params().items()
+            if key != self.parameter_name
+        )
+        yield all_choice
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(**{self.lookup: self.value().strip()})
+        return queryset
+
+
+class AuthorFilter(InputFilter):
+    title = 'автор'
+    parameter_name = 'author'
+    lookup = 'author__username'
+
+
+class UserFilter(InputFilter):
+    title = 'пользователь'
+    parameter_name = 'user'
+    lookup = 'user__username'
+
+
+class RecipeFilter(InputFilter):
+    title = 'рецепт'
+    parameter_name = 'recipe'
+    lookup = 'recipe__name__icontains'
+
+
+@admin.register(Tag)
+class TagAdmin(BaseAdminSettings):
+    list_display = ('name', 'color', 'slug')
+    search_fields = ('name', 'slug')
+    prepopulated_fields = {'slug': ('name',)}
 
 
 @admin.register(Ingredient)
@@ -16,10 +71,7 @@ class IngredientAdmin(BaseAdminSettings):
     list_display = ('name', 'measurement_unit', 'recipes_count')
     search_fields = ('name', 'measurement_unit')
     list_filter = ('measurement_unit',)
-
-    @admin.display(description='Число рецептов')
-    def recipes_count(self, ingredient):
-        return ingredient.recipes.count()
+    readonly_fields = ('recipes_count',)
 
 
 class RecipeIngredientInline(admin.TabularInline):
@@ -35,14 +87,45 @@ class RecipeIngredientInline(admin.TabularInline):
 @admin.register(Recipe)
 class RecipeAdmin(BaseAdminSettings):
     list_display = (
-        'id', 'name', 'cooking_time', 'author', 'favorites_count', 'get_ingredients_list', 'get_image_preview'
+        'id', 'name', 'cooking_time', 'author', 'favorites_count',
+        'shopping_cart_count', 'get_ingredients_list', 'get_image_preview'
+    )
+    readonly_fields = (
+        'get_image_preview', 'favorites_count', 'shopping_cart_count'
     )
-    readonly_fields = ('get_image_preview', 'favorites_count')
     search_fields = ('name', 'author__username')
-    list_filter = ('author', 'name')  # Changed from recipe_author to author
+    list_filter = (AuthorFilter, 'tags')
+    autocomplete_fields = ('author',)
+    filter_horizontal = ('tags',)
     inlines = [RecipeIngredientInline]
     ordering = ('-pub_date',)
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related(
+            'author'
+        ).prefetch_related(
+            Prefetch(
+                'recipe_ingredients',
+                queryset=RecipeIngredient.objects.select_related('ingredient')
+            )
+        )
+
+    def save_related(self, request, form, formsets, change):
+        # The inline writes ingredient rows directly, so the ingredients and
+        # authors on both sides of the edit are recounted afterwards.
+        recipe = form.instance
+        ingredients = set(recipe.recipe_ingredients.values_list(
+            'ingredient_id', flat=True
+        ))
+        super().save_related(request, form, formsets, change)
+        ingredients.update(recipe.recipe_ingredients.values_list(
+            'ingredient_id', flat=True
+        ))
+        recount_ids({
+            'users': {recipe.author_id, form.initial.get('author')} - {None},
+            'ingredients': ingredients,
+        })
+
     # Rest of the methods remain the same
     @admin.display(description='Первью изображения')
     def get_image_preview(self, recipe):
@@ -52,13 +135,9 @@ class RecipeAdmin(BaseAdminSettings):
             )
         return "Нет изображения"
 
-    @admin.display(description='В избранном (раз)', ordering='favorited_by__count')
-    def favorites_count(self, recipe):
-        return recipe.favorited_by.count()
-
     @admin.display(description='Продукты')
     def get_ingredients_list(self, recipe):
-        recipe_ingredients = recipe.recipe_ingredients.select_related('ingredient').all()
+        recipe_ingredients = recipe.recipe_ingredients.all()
         html = '<ul>' + ''.join(
             f'<li>{ingredient.ingredient.name} — {ingredient.amount} {ingredient.ingredient.measurement_unit}</li>' 
             for ingredient in recipe_ingredients
@@ -66,19 +145,41 @@ class RecipeAdmin(BaseAdminSettings):
         return mark_safe(html)
 
 
-@admin.register(Favorite)
-class FavoriteAdmin(admin.ModelAdmin):
-    list_display = ('id', 'user', 'recipe')  # Changed from current_user to user
-    search_fields = ('user__username', 'recipe__name')  # Changed from current_user to user
-    list_filter = ('user', 'recipe')  # Changed from current_user to user
+class UserRecipeRelationAdmin(admin.ModelAdmin):
+    list_display = ('id', 'user', 'recipe')
+    search_fields = ('user__username', 'recipe__name')
+    list_filter = (UserFilter, RecipeFilter)
+    list_select_related = ('user', 'recipe__author')
+    show_full_result_count = False
     ordering = ('id',)
-    autocomplete_fields = ('user', 'recipe')  # Changed from current_user to user
+    autocomplete_fields = ('user', 'recipe')
+
+    def _recount(self, recipe_ids):
+        # Rows added or removed here bypass the API views that move the
+        # recipe counters.
+        recipe_ids = set(recipe_ids) - {None}
+        recount_ids({'recipes': recipe_ids})
+        recount_popularity(recipe_ids)
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        self._recount({obj.recipe_id, form.initial.get('recipe')})
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        self._recount({obj.recipe_id})
+
+    def delete_queryset(self, request, queryset):
+        recipe_ids = set(queryset.values_list('recipe_id', flat=True))
+        super().delete_queryset(request, queryset)
+        self._recount(recipe_ids)
+
+
+@admin.register(Favorite)
+class FavoriteAdmin(UserRecipeRelationAdmin):
+    pass
 
 
 @admin.register(ShoppingCart)
-class ShoppingCartAdmin(admin.ModelAdmin):
-    list_display = ('id', 'user', 'recipe')  # Changed from current_user to user
-    search_fields = ('user__username', 'recipe__name')  # Changed from current_user to user
-    list_filter = ('user', 'recipe')  # Changed from current_user to user
-    ordering = ('id',)
-    autocomplete_fields = ('user', 'recipe')  # Changed from current_user to user
\ No newline at end of file
+class ShoppingCartAdmin(UserRecipeRelationAdmin):
+    pass
@@ -0,0 +1,66 @@
+from django.contrib.auth import get_user_model
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
+
+from users.models import Subscription
+
+from .models import (
+    Favorite, Ingredient, Recipe, RecipeIngredient, ShoppingCart
+)
+
+User = get_user_model()
+
+
+def change_counter(queryset, field, delta):
+    queryset.update(**{field: Greatest(F(field) + delta, 0)})
+
+
+def count_subquery(model, field, **filters):
+    return Coalesce(
+        Subquery(
+            model.objects.filter(
+                **{field: OuterRef('pk')}, **filters
+            ).order_by().values(field).annotate(
+                total=Count('pk')
+            ).values('total'),
+            output_field=IntegerField()
+        ),
+        0
+    )
+
+
+def recount_recipes(queryset):
+    return queryset.update(
+        favorites_count=count_subquery(Favorite, 'recipe'),
+        shopping_cart_count=count_subquery(ShoppingCart, 'recipe'),
+    )
+
+
+def recount_ingredients(queryset):
+    return queryset.update(
+        recipes_count=count_subquery(RecipeIngredient, 'ingredient'),
+    )
+
+
+def recount_users(queryset):
+    return queryset.update(
+        recipes_count=count_subquery(Recipe, 'author'),
+        followers_count=count_subquery(Subscription, 'author'),
+        following_count=count_subquery(Subscription, 'subscriber'),
+    )
+
+
+RECOUNTERS = {
+    'recipes': (Recipe, recount_recipes),
+    'ingredients': (Ingredient, recount_ingredients),
+    'users': (User, recount_users),
+}
+
+
+def recount_ids(ids_by_name):
+    # ids_by_name maps a RECOUNTERS name to the pks whose counters a
+    # deletion cascade may have moved.
+    for name, ids in ids_by_name.items():
+        model, recount = RECOUNTERS[name]
+        if ids:
+            recount(model.objects.filter(pk__in=ids))
@@ -0,0 +1,84 @@
+import heapq
+from itertools import islice
+
+from django.db.models import Q
+
+from constants import FEED_BATCH_SIZE, FEED_FANOUT_THRESHOLD
+from users.models import Subscription
+
+from .models import FeedEntry, Recipe
+
+
+def is_fanned_out(author):
+    # Recipes of authors with many followers are not copied into every
+    # feed; subscribers pick them up when the feed is read.
+    return author.followers_count <= FEED_FANOUT_THRESHOLD
+
+
+def _write_entries(entries):
+    entries = iter(entries)
+    while True:
+        batch = list(islice(entries, FEED_BATCH_SIZE))
+        if not batch:
+            return
+        FeedEntry.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+def fan_out_recipe(recipe):
+    # The decision is stored on the recipe, so it keeps being read from the
+    # right place after the author's follower count crosses the threshold.
+    if not is_fanned_out(recipe.author):
+        return
+    Recipe.objects.filter(pk=recipe.pk).update(fanned_out=True)
+    recipe.fanned_out = True
+    _write_entries(
+        FeedEntry(user_id=user_id, recipe=recipe, pub_date=recipe.pub_date)
+        for user_id in Subscription.objects.filter(
+            author_id=recipe.author_id
+        ).values_list('subscriber_id', flat=True).iterator(
+            chunk_size=FEED_BATCH_SIZE
+        )
+    )
+
+
+def backfill_feed(subscriber, author):
+    _write_entries(
+        FeedEntry(user=subscriber, recipe_id=recipe_id, pub_date=pub_date)
+        for recipe_id, pub_date in Recipe.objects.filter(
+            author=author, fanned_out=True
+        ).values_list('pk', 'pub_date').iterator(chunk_size=FEED_BATCH_SIZE)
+    )
+
+
+def remove_from_feed(subscriber, author):
+    FeedEntry.objects.filter(user=subscriber, recipe__author=author).delete()
+
+
+def _older_than(position, date_field, id_field):
+    if position is None:
+        return Q()
+    date_value, id_value = position
+    return Q(**{f'{date_field}__lte': date_value}) & (
+        Q(**{f'{date_field}__lt': date_value})
+        | Q(**{f'{id_field}__lt': id_value})
+    )
+
+
+def get_feed_positions(user, limit, position=None):
+    # Returns up to limit (pub_date, recipe id) pairs older than position.
+    # Fanned out recipes come from the user's feed entries, the others
+    # straight from the followed authors; both are read in keyset order
+    # and merged.
+    entries = FeedEntry.objects.filter(
+        _older_than(position, 'pub_date', 'recipe_id'), user=user
+    ).order_by('-pub_date', '-recipe_id').values_list(
+        'pub_date', 'recipe_id'
+    )[:limit]
+    pulled = Recipe.objects.filter(
+        _older_than(position, 'pub_date', 'id'),
+        fanned_out=False,
+        author__in=Subscription.objects.filter(
+            subscriber=user
+        ).values('author')
+    ).order_by('-pub_date', '-id').values_list('pub_date', 'id')[:limit]
+    return list(islice(heapq.merge(entries, pulled, reverse=True), limit))
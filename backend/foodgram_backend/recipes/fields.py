@@ -0,0 +1,59 @@
+import hashlib
+import os
+
+from django.db import models
+from django.db.models.fields.files import ImageFieldFile
+
+HASH_LENGTH = 32
+# Matches names produced by content_hash_name, in any upload directory.
+HASHED_NAME_REGEX = rf'(^|/)[0-9a-f]{{{HASH_LENGTH}}}(\.[^./]*)?$'
+
+
+def content_hash_name(name, content):
+    digest = hashlib.sha256()
+    content.seek(0)
+    for chunk in content.chunks():
+        digest.update(chunk)
+    content.seek(0)
+    extension = os.path.splitext(name)[1].lower()
+    return f'{digest.hexdigest()[:HASH_LENGTH]}{extension}'
+
+
+class ContentHashFieldFile(ImageFieldFile):
+
+    def _set_url(self):
+        if self.field.url_field:
+            setattr(
+                self.instance, self.field.url_field,
+                self.url if self.name else ''
+            )
+
+    def save(self, name, content, save=True):
+        super().save(content_hash_name(name, content), content, save=False)
+        self._set_url()
+        if save:
+            self.instance.save()
+
+    def delete(self, save=True):
+        super().delete(save=False)
+        self._set_url()
+        if save:
+            self.instance.save()
+
+
+class ContentHashImageField(models.ImageField):
+    # Files are named after a hash of their content, so a URL never
+    # changes meaning and can be cached forever. The URL itself is
+    # copied into url_field on upload, so reading it needs no storage
+    # call.
+    attr_class = ContentHashFieldFile
+
+    def __init__(self, *args, url_field=None, **kwargs):
+        self.url_field = url_field
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        if self.url_field:
+            kwargs['url_field'] = self.url_field
+        return name, path, args, kwargs
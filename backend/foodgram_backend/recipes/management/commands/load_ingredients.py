@@ -1,33 +1,266 @@
+import csv
 import json
+import re
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from itertools import islice
 from pathlib import Path
+
 from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError, connection
+
+from api.ingredients import bump_catalog_version
 from recipes.models import Ingredient
 
+READ_SIZE = 64 * 1024
+SEPARATORS = re.compile(r'[\s,]*')
+
+
+def iter_json_array(file):
+    # Reads a top-level JSON array element by element, so only the current
+    # chunk of the file is held in memory.
+    decoder = json.JSONDecoder()
+    buffer = file.read(READ_SIZE).lstrip()
+    if not buffer.startswith('['):
+        raise CommandError('JSON файл должен содержать список объектов.')
+    pos = 1
+    eof = False
+    while True:
+        pos = SEPARATORS.match(buffer, pos).end()
+        if buffer.startswith(']', pos):
+            return
+        try:
+            item, pos = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            if eof:
+                raise CommandError('Некорректный JSON: файл оборван.')
+            chunk = file.read(READ_SIZE)
+            eof = not chunk
+            buffer = buffer[pos:] + chunk
+            pos = 0
+            continue
+        yield item
+
+
+def iter_json_rows(file):
+    for item in iter_json_array(file):
+        if not isinstance(item, dict):
+            yield None, None
+            continue
+        fields = item.get('fields', item)
+        yield fields.get('name'), fields.get('measurement_unit')
+
+
+def iter_fixture_rows(file):
+    for item in iter_json_array(file):
+        if (
+            not isinstance(item, dict)
+            or item.get('model') != 'recipes.ingredient'
+        ):
+            yield None, None
+            continue
+        fields = item.get('fields') or {}
+        yield fields.get('name'), fields.get('measurement_unit')
+
+
+def iter_csv_rows(file):
+    for row in csv.reader(file):
+        if row == ['name', 'measurement_unit']:
+            continue
+        if len(row) != 2:
+            yield None, None
+            continue
+        yield row[0], row[1]
+
+
+READERS = {
+    'json': iter_json_rows,
+    'fixture': iter_fixture_rows,
+    'csv': iter_csv_rows,
+}
+
+
 class Command(BaseCommand):
-    help = 'Загружает ингредиенты из <filename>.json в /app/fixtures/ в базу данных'
+    help = (
+        'Загружает ингредиенты из JSON, CSV или фикстуры Django. Файл '
+        'читается потоково и записывается пачками; строки, уже '
+        'существующие по (name, measurement_unit), пропускаются.'
+    )
     FIXTURES_DIR = Path('/app/fixtures')
 
     def add_arguments(self, parser):
-        parser.add_argument('filename', type=str, help='Имя файла (например, ingredients.json) в директории /app/fixtures/')
-        parser.add_argument('--clear', action='store_true', help='Очистить таблицу Ingredient перед загрузкой новых данных.')
+        parser.add_argument(
+            'filename', type=str,
+            help='Путь к файлу или имя файла в директории /app/fixtures/.'
+        )
+        parser.add_argument(
+            '--format', choices=sorted(READERS), default=None,
+            help='Формат файла. По умолчанию определяется по расширению.'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Число строк в одной пачке INSERT.'
+        )
+        parser.add_argument(
+            '--workers', type=int, default=1,
+            help='Число потоков, параллельно записывающих пачки.'
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Только посчитать статистику, ничего не записывая.'
+        )
+        parser.add_argument(
+            '--clear', action='store_true',
+            help='Очистить таблицу Ingredient перед загрузкой новых данных.'
+        )
+
+    def _get_path(self, filename):
+        path = Path(filename)
+        if path.is_absolute() or path.exists():
+            return path
+        return self.FIXTURES_DIR / filename
+
+    def _get_format(self, path, file_format):
+        if file_format:
+            return file_format
+        if path.suffix.lower() == '.csv':
+            return 'csv'
+        if 'fixture' in path.stem.lower():
+            return 'fixture'
+        return 'json'
+
+    def _iter_batches(self, rows, batch_size, stats):
+        name_length = Ingredient._meta.get_field('name').max_length
+        unit_length = Ingredient._meta.get_field(
+            'measurement_unit'
+        ).max_length
+        rows = iter(rows)
+        while True:
+            chunk = list(islice(rows, batch_size))
+            if not chunk:
+                return
+            batch = {}
+            for name, unit in chunk:
+                stats['read'] += 1
+                if not isinstance(name, str) or not isinstance(unit, str):
+                    stats['invalid'] += 1
+                    continue
+                name, unit = name.strip(), unit.strip()
+                if (
+                    not name or not unit
+                    or len(name) > name_length or len(unit) > unit_length
+                ):
+                    stats['invalid'] += 1
+                    continue
+                if (name, unit) in batch:
+                    stats['duplicates'] += 1
+                    continue
+                batch[name, unit] = Ingredient(
+                    name=name, measurement_unit=unit
+                )
+            if batch:
+                # Sorted batches insert conflicting keys in the same order,
+                # so parallel inserts cannot deadlock each other.
+                yield [batch[key] for key in sorted(batch)]
+
+    def _write_batch(self, batch, close_connection):
+        try:
+            Ingredient.objects.bulk_create(batch, ignore_conflicts=True)
+            return len(batch)
+        finally:
+            if close_connection:
+                connection.close()
+
+    def _clear(self):
+        # A single DELETE: no rows are loaded and no per-object signals
+        # are sent. The catalog version is bumped once after the load.
+        table = connection.ops.quote_name(Ingredient._meta.db_table)
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(f'DELETE FROM {table}')
+        except IntegrityError:
+            raise CommandError(
+                'Нельзя очистить таблицу: ингредиенты используются в '
+                'рецептах.'
+            )
+
+    def _count_existing(self, batch):
+        keys = {(item.name, item.measurement_unit) for item in batch}
+        return sum(
+            1 for key in Ingredient.objects.filter(
+                name__in={name for name, _ in keys}
+            ).values_list('name', 'measurement_unit')
+            if key in keys
+        )
+
+    def _load(self, batches, workers, dry_run, stats):
+        if dry_run:
+            for batch in batches:
+                existing = self._count_existing(batch)
+                stats['existing'] += existing
+                stats['written'] += len(batch) - existing
+            return
+        if workers <= 1:
+            for batch in batches:
+                stats['written'] += self._write_batch(batch, False)
+            return
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = set()
+            for batch in batches:
+                # Only a bounded number of batches is in flight at a time.
+                if len(pending) >= workers * 2:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    stats['written'] += sum(f.result() for f in done)
+                pending.add(executor.submit(self._write_batch, batch, True))
+            stats['written'] += sum(f.result() for f in wait(pending).done)
 
     def handle(self, *args, **options):
-        file_path = self.FIXTURES_DIR / options['filename']
+        path = self._get_path(options['filename'])
+        file_format = self._get_format(path, options['format'])
+        if options['batch_size'] < 1 or options['workers'] < 1:
+            raise CommandError(
+                'Размер пачки и число потоков должны быть положительными.'
+            )
+        stats = dict.fromkeys(
+            ('read', 'invalid', 'duplicates', 'written', 'existing'), 0
+        )
+        started = time.perf_counter()
         try:
-            if options['clear']:
-                Ingredient.objects.all().delete()
-            with open(file_path, 'r', encoding='utf-8') as file:
-                data = json.load(file)
-            if not isinstance(data, list):
-                raise CommandError('JSON файл должен содержать список объектов.')
-            existing = set(Ingredient.objects.values_list('name', flat=True))
-            to_create = [Ingredient(**item) for item in data if item.get('name') and item.get('measurement_unit') and item['name'].lower() not in existing]
-            Ingredient.objects.bulk_create(to_create, ignore_conflicts=True)
-            self.stdout.write(self.style.SUCCESS(
-                f'Загрузка из "{options["filename"]}" завершена. '
-                f'Добавлено новых: {len(to_create)}, '
-                f'Пропущено/Обновлено: {len(data) - len(to_create)}, '
-                f'Ошибок при сохранении: 0.'
-            ))
+            if options['clear'] and not options['dry_run']:
+                self._clear()
+            before = Ingredient.objects.count()
+            with open(path, 'r', encoding='utf-8', newline='') as file:
+                self._load(
+                    self._iter_batches(
+                        READERS[file_format](file),
+                        options['batch_size'],
+                        stats
+                    ),
+                    options['workers'],
+                    options['dry_run'],
+                    stats,
+                )
+        except CommandError:
+            raise
         except Exception as e:
-            raise CommandError(f'Ошибка загрузки из "{options["filename"]}": {e}')
+            raise CommandError(
+                f'Ошибка загрузки из "{options["filename"]}": {e}'
+            )
+        elapsed = time.perf_counter() - started
+        if options['dry_run']:
+            created = stats['written']
+        else:
+            created = Ingredient.objects.count() - before
+            stats['existing'] = stats['written'] - created
+            bump_catalog_version()
+        self.stdout.write(self.style.SUCCESS(
+            f'{"Проверка" if options["dry_run"] else "Загрузка"} '
+            f'из "{options["filename"]}" ({file_format}) завершена. '
+            f'Прочитано строк: {stats["read"]}, '
+            f'добавлено новых: {created}, '
+            f'уже были в базе: {stats["existing"]}, '
+            f'дубликатов в файле: {stats["duplicates"]}, '
+            f'некорректных: {stats["invalid"]}. '
+            f'Время: {elapsed:.2f} с, '
+            f'скорость: {stats["read"] / max(elapsed, 1e-9):.0f} строк/с.'
+        ))
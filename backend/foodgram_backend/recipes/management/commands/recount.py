@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Max, Min
+
+from recipes.counters import RECOUNTERS
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересчитывает денормализованные счётчики рецептов, ингредиентов '
+        'и пользователей пачками по id.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--only', choices=sorted(RECOUNTERS), action='append',
+            help='Пересчитать только указанные таблицы.'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=10000,
+            help='Число id в одной пачке UPDATE.'
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError('Размер пачки должен быть положительным.')
+        for name in options['only'] or sorted(RECOUNTERS):
+            model, recount = RECOUNTERS[name]
+            bounds = model.objects.aggregate(first=Min('pk'), last=Max('pk'))
+            updated = 0
+            if bounds['first'] is not None:
+                for start in range(
+                    bounds['first'], bounds['last'] + 1, batch_size
+                ):
+                    updated += recount(model.objects.filter(
+                        pk__gte=start, pk__lt=start + batch_size
+                    ))
+            self.stdout.write(self.style.SUCCESS(
+                f'{name}: пересчитано строк {updated}.'
+            ))
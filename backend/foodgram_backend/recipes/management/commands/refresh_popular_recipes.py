@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from constants import POPULARITY_BATCH_SIZE
+from recipes.popularity import refresh_popularity
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересчитывает рейтинг популярных рецептов за сутки, неделю и всё '
+        'время. Запускается по расписанию, например из cron.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=POPULARITY_BATCH_SIZE,
+            help='Число строк в одной пачке INSERT.'
+        )
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('Размер пачки должен быть положительным.')
+        started = time.perf_counter()
+        created = refresh_popularity(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Рейтинг обновлён: рецептов {created}, '
+            f'время {time.perf_counter() - started:.2f} с.'
+        ))
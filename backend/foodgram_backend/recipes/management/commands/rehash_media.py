@@ -0,0 +1,66 @@
+import os
+
+from django.contrib.auth import get_user_model
+from django.core.files import File
+from django.core.management.base import BaseCommand
+from django.db.models import F, Q
+from django.utils import timezone
+
+from recipes.fields import HASHED_NAME_REGEX
+from recipes.models import Recipe
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        'Переименовывает загруженные ранее изображения рецептов и аватары '
+        'по хешу содержимого и сохраняет их адреса в модели.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help='Число объектов, читаемых из базы за один запрос.'
+        )
+
+    def _rehash(self, model, field_name, batch_size):
+        # The URL column is filled by the migration for every file, so
+        # the files still to rename are found by their names.
+        field = model._meta.get_field(field_name)
+        queryset = model.objects.exclude(
+            Q(**{field_name: ''}) | Q(**{f'{field_name}__isnull': True})
+            | Q(**{f'{field_name}__regex': HASHED_NAME_REGEX})
+        ).only('pk', field_name)
+        renamed = missing = 0
+        for obj in queryset.iterator(chunk_size=batch_size):
+            file = getattr(obj, field_name)
+            old_name = file.name
+            try:
+                with file.storage.open(old_name, 'rb') as source:
+                    file.save(
+                        os.path.basename(old_name), File(source), save=False
+                    )
+            except FileNotFoundError:
+                missing += 1
+                continue
+            model.objects.filter(pk=obj.pk).update(**{
+                field_name: file.name,
+                field.url_field: getattr(obj, field.url_field),
+                'version': F('version') + 1,
+                'updated_at': timezone.now(),
+            })
+            if file.name != old_name:
+                file.storage.delete(old_name)
+            renamed += 1
+        return renamed, missing
+
+    def handle(self, *args, **options):
+        for model, field_name in ((Recipe, 'image'), (User, 'avatar')):
+            renamed, missing = self._rehash(
+                model, field_name, options['batch_size']
+            )
+            self.stdout.write(self.style.SUCCESS(
+                f'{model._meta.verbose_name_plural}: переименовано '
+                f'{renamed}, файлов не найдено {missing}.'
+            ))
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Max, Min
+
+from recipes.models import RECIPE_SEARCH_VECTOR, Recipe
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает поисковые векторы рецептов пачками по id.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=10000,
+            help='Число id рецептов в одной пачке UPDATE.'
+        )
+        parser.add_argument(
+            '--only-missing', action='store_true',
+            help='Обновить только рецепты без поискового вектора.'
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError('Размер пачки должен быть положительным.')
+        queryset = Recipe.objects.all()
+        if options['only_missing']:
+            queryset = queryset.filter(search_vector__isnull=True)
+        bounds = queryset.aggregate(first=Min('pk'), last=Max('pk'))
+        if bounds['first'] is None:
+            self.stdout.write('Нет рецептов для обновления.')
+            return
+        updated = 0
+        for start in range(bounds['first'], bounds['last'] + 1, batch_size):
+            updated += queryset.filter(
+                pk__gte=start, pk__lt=start + batch_size
+            ).update(search_vector=RECIPE_SEARCH_VECTOR)
+        self.stdout.write(self.style.SUCCESS(
+            f'Поисковые векторы обновлены у {updated} рецептов.'
+        ))
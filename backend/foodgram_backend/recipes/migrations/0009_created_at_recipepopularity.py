@@ -0,0 +1,49 @@
+# Generated by Django 4.2.19 on 2026-10-18 18:57
+
+import datetime
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+# Rows that existed before created_at was tracked get a date far in the
+# past, so they count towards the all-time score only.
+ADDED_BEFORE_TRACKING = datetime.datetime(
+    2000, 1, 1, tzinfo=datetime.timezone.utc
+)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0008_fill_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='favorite',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, db_index=True, default=ADDED_BEFORE_TRACKING, verbose_name='Дата добавления'),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='shoppingcart',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, db_index=True, default=ADDED_BEFORE_TRACKING, verbose_name='Дата добавления'),
+            preserve_default=False,
+        ),
+        migrations.CreateModel(
+            name='RecipePopularity',
+            fields=[
+                ('recipe', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='popularity', serialize=False, to='recipes.recipe', verbose_name='Рецепт')),
+                ('score_day', models.PositiveIntegerField(default=0, verbose_name='Популярность за сутки')),
+                ('score_week', models.PositiveIntegerField(default=0, verbose_name='Популярность за неделю')),
+                ('score_all', models.PositiveIntegerField(default=0, verbose_name='Популярность за всё время')),
+                ('refreshed_at', models.DateTimeField(verbose_name='Дата пересчёта')),
+            ],
+            options={
+                'verbose_name': 'Популярность рецепта',
+                'verbose_name_plural': 'Популярность рецептов',
+                'indexes': [models.Index(fields=['-score_day', '-recipe'], name='popularity_day_idx'), models.Index(fields=['-score_week', '-recipe'], name='popularity_week_idx'), models.Index(fields=['-score_all', '-recipe'], name='popularity_all_idx')],
+            },
+        ),
+    ]
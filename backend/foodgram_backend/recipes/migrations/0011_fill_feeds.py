@@ -0,0 +1,42 @@
+from itertools import islice
+
+from django.db import migrations
+
+from constants import FEED_BATCH_SIZE, FEED_FANOUT_THRESHOLD
+
+
+def fill_feeds(apps, schema_editor):
+    # Existing subscriptions get the same entries a new subscription
+    # would get from backfill_feed.
+    FeedEntry = apps.get_model('recipes', 'FeedEntry')
+    Recipe = apps.get_model('recipes', 'Recipe')
+    rows = Recipe.objects.filter(
+        author__subscribers__isnull=False,
+        author__followers_count__lte=FEED_FANOUT_THRESHOLD
+    ).values_list(
+        'author__subscribers__subscriber_id', 'pk', 'pub_date'
+    ).order_by().iterator(chunk_size=FEED_BATCH_SIZE)
+    while True:
+        batch = list(islice(rows, FEED_BATCH_SIZE))
+        if not batch:
+            return
+        FeedEntry.objects.bulk_create(
+            [
+                FeedEntry(user_id=user_id, recipe_id=recipe_id,
+                          pub_date=pub_date)
+                for user_id, recipe_id, pub_date in batch
+            ],
+            ignore_conflicts=True
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0010_feedentry'),
+        ('users', '0007_counters'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_feeds, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 4.2.19 on 2026-10-18 18:58
+
+from django.db import migrations, models
+import recipes.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0012_recipe_image_renditions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='image_url',
+            field=models.CharField(blank=True, editable=False, max_length=255, verbose_name='Адрес изображения'),
+        ),
+        migrations.AlterField(
+            model_name='recipe',
+            name='image',
+            field=recipes.fields.ContentHashImageField(help_text='Загрузите изображение рецепта', upload_to='recipes', url_field='image_url', verbose_name='Изображение'),
+        ),
+    ]
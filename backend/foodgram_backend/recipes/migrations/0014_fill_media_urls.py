@@ -0,0 +1,41 @@
+from django.db import migrations
+
+BATCH_SIZE = 500
+
+
+def fill_urls(model, field_name):
+    # Existing files keep their names; rehash_media renames them later.
+    field = model._meta.get_field(field_name)
+    queryset = model.objects.exclude(
+        **{field_name: ''}
+    ).exclude(
+        **{f'{field_name}__isnull': True}
+    ).only('pk', field_name).order_by('pk')
+    batch = []
+    for obj in queryset.iterator(chunk_size=BATCH_SIZE):
+        setattr(obj, field.url_field, field.storage.url(
+            getattr(obj, field.attname).name
+        ))
+        batch.append(obj)
+        if len(batch) == BATCH_SIZE:
+            model.objects.bulk_update(batch, [field.url_field])
+            batch = []
+    if batch:
+        model.objects.bulk_update(batch, [field.url_field])
+
+
+def fill_media_urls(apps, schema_editor):
+    fill_urls(apps.get_model('recipes', 'Recipe'), 'image')
+    fill_urls(apps.get_model('users', 'User'), 'avatar')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0013_recipe_image_url'),
+        ('users', '0009_user_avatar_url'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_media_urls, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.19 on 2026-10-18 18:58
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0014_fill_media_urls'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tag',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=32, unique=True, verbose_name='Название тега')),
+                ('color', models.CharField(help_text='Цвет в формате HEX, например #E26C2D', max_length=7, validators=[django.core.validators.RegexValidator(message='Цвет должен быть в формате HEX, например #E26C2D.', regex='^#[0-9A-Fa-f]{6}$')], verbose_name='Цвет')),
+                ('slug', models.SlugField(max_length=32, unique=True, verbose_name='Слаг')),
+            ],
+            options={
+                'verbose_name': 'Тег',
+                'verbose_name_plural': 'Теги',
+                'ordering': ['name'],
+            },
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='tags',
+            field=models.ManyToManyField(related_name='recipes', to='recipes.tag', verbose_name='Теги'),
+        ),
+    ]
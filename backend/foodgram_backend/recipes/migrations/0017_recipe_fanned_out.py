@@ -0,0 +1,37 @@
+# Generated by Django 4.2.19 on 2026-10-18 19:02
+
+from django.db import migrations, models
+
+from constants import FEED_FANOUT_THRESHOLD
+
+
+def mark_fanned_out(apps, schema_editor):
+    # Until now a recipe was fanned out if its author had few enough
+    # followers at the time. Entries left from before an author crossed
+    # the threshold would duplicate the pulled recipes, so they go.
+    FeedEntry = apps.get_model('recipes', 'FeedEntry')
+    Recipe = apps.get_model('recipes', 'Recipe')
+    Recipe.objects.filter(
+        author__followers_count__lte=FEED_FANOUT_THRESHOLD
+    ).update(fanned_out=True)
+    FeedEntry.objects.filter(recipe__fanned_out=False).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0016_recipe_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='fanned_out',
+            field=models.BooleanField(default=False, editable=False, verbose_name='Разослан в ленты подписчиков'),
+        ),
+        migrations.RunPython(mark_fanned_out, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(condition=models.Q(('fanned_out', False)), fields=['author', '-pub_date', '-id'], name='recipe_pulled_feed_idx'),
+        ),
+    ]
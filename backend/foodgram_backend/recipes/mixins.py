@@ -0,0 +1,21 @@
+class DenormalizedFieldsMixin:
+    # Columns listed in denormalized_fields are only ever changed with
+    # queryset updates. A full save() of an existing row writes every other
+    # column, so an instance loaded before such an update never puts the
+    # old value back.
+    denormalized_fields = ()
+
+    def save(self, *args, **kwargs):
+        if (
+            kwargs.get('update_fields') is None
+            and not kwargs.get('force_insert')
+            and not self._state.adding
+        ):
+            deferred = self.get_deferred_fields()
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in self.denormalized_fields
+                and field.attname not in deferred
+            ]
+        super().save(*args, **kwargs)
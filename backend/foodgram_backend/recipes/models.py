@@ -1,17 +1,32 @@
 from django.db import models
 from django.contrib.auth import get_user_model
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector, SearchVectorField
 from django.core.validators import MinValueValidator
 from django.core.validators import RegexValidator
 
 from constants import (
     MIN_AMOUNT_VALUE,
-    MIN_COOKING_TIME_VALUE
+    MIN_COOKING_TIME_VALUE,
+    TAG_COLOR_MAX_LENGTH,
+    TAG_NAME_MAX_LENGTH,
+    TAG_SLUG_MAX_LENGTH
 )
 
+from .fields import ContentHashImageField
+from .mixins import DenormalizedFieldsMixin
+
 User = get_user_model()
 
+RECIPE_SEARCH_VECTOR = (
+    SearchVector('name', weight='A', config='russian')
+    + SearchVector('text', weight='B', config='russian')
+)
+
+
+class Ingredient(DenormalizedFieldsMixin, models.Model):
+    denormalized_fields = ('recipes_count',)
 
-class Ingredient(models.Model):
     name = models.CharField(
         verbose_name='Название ингредиента',
         max_length=200,
@@ -23,6 +38,12 @@ class Ingredient(models.Model):
         max_length=50,
     )
 
+    recipes_count = models.PositiveIntegerField(
+        verbose_name='Число рецептов',
+        default=0,
+        editable=False
+    )
+
     class Meta:
         verbose_name = 'Ингредиент'
         verbose_name_plural = 'Ингредиенты'
@@ -38,7 +59,44 @@ class Ingredient(models.Model):
         return f'{self.name}, {self.measurement_unit}'
 
 
-class Recipe(models.Model):
+class Tag(models.Model):
+    name = models.CharField(
+        verbose_name='Название тега',
+        max_length=TAG_NAME_MAX_LENGTH,
+        unique=True
+    )
+
+    color = models.CharField(
+        verbose_name='Цвет',
+        max_length=TAG_COLOR_MAX_LENGTH,
+        validators=[RegexValidator(
+            regex=r'^#[0-9A-Fa-f]{6}$',
+            message='Цвет должен быть в формате HEX, например #E26C2D.'
+        )],
+        help_text='Цвет в формате HEX, например #E26C2D'
+    )
+
+    slug = models.SlugField(
+        verbose_name='Слаг',
+        max_length=TAG_SLUG_MAX_LENGTH,
+        unique=True
+    )
+
+    class Meta:
+        verbose_name = 'Тег'
+        verbose_name_plural = 'Теги'
+        ordering = ['name']
+
+    def __str__(self):
+        return self.name
+
+
+class Recipe(DenormalizedFieldsMixin, models.Model):
+    denormalized_fields = (
+        'favorites_count', 'shopping_cart_count', 'image_renditions',
+        'fanned_out'
+    )
+
     author = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
@@ -52,12 +110,33 @@ class Recipe(models.Model):
         db_index=True
     )
 
-    image = models.ImageField(
+    tags = models.ManyToManyField(
+        Tag,
+        related_name='recipes',
+        verbose_name='Теги'
+    )
+
+    image = ContentHashImageField(
         verbose_name='Изображение',
         upload_to='recipes',
+        url_field='image_url',
         help_text='Загрузите изображение рецепта'
     )
 
+    image_url = models.CharField(
+        verbose_name='Адрес изображения',
+        max_length=255,
+        blank=True,
+        editable=False
+    )
+
+    image_renditions = models.JSONField(
+        verbose_name='Уменьшенные копии изображения',
+        default=dict,
+        blank=True,
+        editable=False
+    )
+
     text = models.TextField(
         verbose_name='Описание рецепта',
         help_text='Введите описание рецепта'
@@ -84,14 +163,86 @@ class Recipe(models.Model):
         db_index=True
     )
 
+    favorites_count = models.PositiveIntegerField(
+        verbose_name='В избранном (раз)',
+        default=0,
+        editable=False,
+        db_index=True
+    )
+
+    shopping_cart_count = models.PositiveIntegerField(
+        verbose_name='В списках покупок (раз)',
+        default=0,
+        editable=False,
+        db_index=True
+    )
+
+    fanned_out = models.BooleanField(
+        verbose_name='Разослан в ленты подписчиков',
+        default=False,
+        editable=False
+    )
+
+    search_vector = SearchVectorField(
+        verbose_name='Поисковый вектор',
+        null=True,
+        editable=False
+    )
+
+    updated_at = models.DateTimeField(
+        verbose_name='Дата изменения',
+        auto_now=True
+    )
+
+    version = models.PositiveIntegerField(
+        verbose_name='Версия',
+        default=0,
+        editable=False
+    )
+
     class Meta:
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
-        ordering = ['-pub_date']
+        ordering = ['-pub_date', '-id']
+        indexes = [
+            models.Index(
+                fields=['-pub_date', '-id'],
+                name='recipe_pub_date_id_idx'
+            ),
+            models.Index(
+                fields=['author', '-pub_date', '-id'],
+                name='recipe_pulled_feed_idx',
+                condition=models.Q(fanned_out=False)
+            ),
+            GinIndex(
+                fields=['search_vector'],
+                name='recipe_search_vector_idx'
+            ),
+            GinIndex(
+                fields=['name'],
+                name='recipe_name_trgm_idx',
+                opclasses=['gin_trgm_ops']
+            ),
+        ]
 
     def __str__(self):
         return f'{self.name} (Автор: {self.author.username})'
 
+    def save(self, *args, **kwargs):
+        # Ingredients and tags are written together with the recipe, so
+        # every change of the API representation passes through here.
+        self.version += 1
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = {
+                *update_fields, 'version', 'updated_at'
+            }
+        super().save(*args, **kwargs)
+        if update_fields is None or {'name', 'text'} & set(update_fields):
+            Recipe.objects.filter(pk=self.pk).update(
+                search_vector=RECIPE_SEARCH_VECTOR
+            )
+
 
 class RecipeIngredient(models.Model):
     recipe = models.ForeignKey(
@@ -145,6 +296,12 @@ class UserRecipeRelationBase(models.Model):
         verbose_name='Рецепт'
     )
 
+    created_at = models.DateTimeField(
+        verbose_name='Дата добавления',
+        auto_now_add=True,
+        db_index=True
+    )
+
     class Meta:
         abstract = True
         constraints = [
@@ -159,6 +316,8 @@ class UserRecipeRelationBase(models.Model):
 
 
 class Favorite(UserRecipeRelationBase):
+    recipe_counter_field = 'favorites_count'
+
     class Meta(UserRecipeRelationBase.Meta):
         default_related_name = 'favorites'
         verbose_name = 'Избранный рецепт'
@@ -166,7 +325,104 @@ class Favorite(UserRecipeRelationBase):
 
 
 class ShoppingCart(UserRecipeRelationBase):
+    recipe_counter_field = 'shopping_cart_count'
+
     class Meta(UserRecipeRelationBase.Meta):
         default_related_name = 'shopping_cart'
         verbose_name = 'Рецепт в списке покупок'
-        verbose_name_plural = 'Рецепты в списке покупок'
\ No newline at end of file
+        verbose_name_plural = 'Рецепты в списке покупок'
+
+
+class FeedEntry(models.Model):
+    # One row per (subscriber, recipe) written when a recipe of an author
+    # below the fan-out threshold is published, so most of the home feed
+    # is a range scan over the user's rows.
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='feed_entries',
+        verbose_name='Подписчик'
+    )
+
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='feed_entries',
+        verbose_name='Рецепт'
+    )
+
+    pub_date = models.DateTimeField(
+        verbose_name='Дата публикации'
+    )
+
+    class Meta:
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Записи ленты'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'recipe'],
+                name='unique_feed_entry'
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=['user', '-pub_date', '-recipe'],
+                name='feed_entry_user_pub_date_idx'
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.user_id} - {self.recipe_id}'
+
+
+class RecipePopularity(models.Model):
+    # Summary table rebuilt by the refresh_popular_recipes command, so
+    # the popular feed is read from an index instead of aggregating
+    # Favorite and ShoppingCart on every request.
+    recipe = models.OneToOneField(
+        Recipe,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='popularity',
+        verbose_name='Рецепт'
+    )
+
+    score_day = models.PositiveIntegerField(
+        verbose_name='Популярность за сутки',
+        default=0
+    )
+
+    score_week = models.PositiveIntegerField(
+        verbose_name='Популярность за неделю',
+        default=0
+    )
+
+    score_all = models.PositiveIntegerField(
+        verbose_name='Популярность за всё время',
+        default=0
+    )
+
+    refreshed_at = models.DateTimeField(
+        verbose_name='Дата пересчёта'
+    )
+
+    class Meta:
+        verbose_name = 'Популярность рецепта'
+        verbose_name_plural = 'Популярность рецептов'
+        indexes = [
+            models.Index(
+                fields=['-score_day', '-recipe'],
+                name='popularity_day_idx'
+            ),
+            models.Index(
+                fields=['-score_week', '-recipe'],
+                name='popularity_week_idx'
+            ),
+            models.Index(
+                fields=['-score_all', '-recipe'],
+                name='popularity_all_idx'
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.recipe_id}: {self.score_all}'
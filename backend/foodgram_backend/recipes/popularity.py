@@ -0,0 +1,71 @@
+from datetime import timedelta
+from itertools import islice
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from constants import POPULARITY_BATCH_SIZE
+
+from .counters import count_subquery
+from .models import Favorite, Recipe, RecipePopularity, ShoppingCart
+
+POPULARITY_PERIODS = {
+    'day': 'score_day',
+    'week': 'score_week',
+    'all': 'score_all',
+}
+
+
+def _score(**filters):
+    return (
+        count_subquery(Favorite, 'recipe', **filters)
+        + count_subquery(ShoppingCart, 'recipe', **filters)
+    )
+
+
+def _window_score(since):
+    return _score(created_at__gte=since)
+
+
+def refresh_popularity(batch_size=POPULARITY_BATCH_SIZE):
+    # The table is rebuilt inside one transaction, so readers keep seeing
+    # the previous ranking until the new one is committed.
+    now = timezone.now()
+    rows = Recipe.objects.annotate(
+        score_all=F('favorites_count') + F('shopping_cart_count'),
+    ).filter(score_all__gt=0).annotate(
+        score_day=_window_score(now - timedelta(days=1)),
+        score_week=_window_score(now - timedelta(days=7)),
+    ).order_by('pk').values_list(
+        'pk', 'score_day', 'score_week', 'score_all'
+    ).iterator(chunk_size=batch_size)
+    created = 0
+    with transaction.atomic():
+        RecipePopularity.objects.all().delete()
+        while True:
+            batch = [
+                RecipePopularity(
+                    recipe_id=pk,
+                    score_day=day,
+                    score_week=week,
+                    score_all=total,
+                    refreshed_at=now,
+                )
+                for pk, day, week, total in islice(rows, batch_size)
+            ]
+            if not batch:
+                return created
+            RecipePopularity.objects.bulk_create(batch)
+            created += len(batch)
+
+
+def recount_popularity(recipe_ids):
+    # Brings the ranked rows of these recipes up to date right away, for
+    # changes that the next refresh would otherwise have to catch.
+    now = timezone.now()
+    return RecipePopularity.objects.filter(recipe_id__in=recipe_ids).update(
+        score_day=_window_score(now - timedelta(days=1)),
+        score_week=_window_score(now - timedelta(days=7)),
+        score_all=_score(),
+    )
@@ -0,0 +1,137 @@
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from .admin import RecipeAdmin
+from .counters import RECOUNTERS
+from .models import (
+    Favorite, Ingredient, Recipe, RecipeIngredient, RecipePopularity, Tag
+)
+from .popularity import refresh_popularity
+
+User = get_user_model()
+
+
+class RecipeAdminChangelistTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser(
+            username='admin', email='admin@example.com', password='password',
+            first_name='admin', last_name='admin'
+        )
+        tag = Tag.objects.create(name='Завтрак', color='#E26C2D', slug='tag')
+        ingredients = [
+            Ingredient.objects.create(name=name, measurement_unit='г')
+            for name in ('соль', 'сахар')
+        ]
+        for number in range(30):
+            recipe = Recipe.objects.create(
+                author=cls.admin, name=f'Рецепт {number}', text='Описание',
+                cooking_time=10, image='recipes/test.png'
+            )
+            recipe.tags.add(tag)
+            RecipeIngredient.objects.bulk_create(
+                RecipeIngredient(recipe=recipe, ingredient=ingredient,
+                                 amount=1)
+                for ingredient in ingredients
+            )
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+        self.url = reverse('admin:recipes_recipe_changelist')
+
+    def get_changelist(self, per_page):
+        with mock.patch.object(RecipeAdmin, 'list_per_page', per_page):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            len(response.context['cl'].result_list), per_page
+        )
+
+    def test_query_count_does_not_depend_on_page_size(self):
+        self.get_changelist(1)
+        with CaptureQueriesContext(connection) as small_page:
+            self.get_changelist(5)
+        with self.assertNumQueries(len(small_page)):
+            self.get_changelist(25)
+
+
+class AdminCountersTests(TestCase):
+
+    def setUp(self):
+        self.admin = User.objects.create_superuser(
+            username='admin', email='admin@example.com', password='password',
+            first_name='admin', last_name='admin'
+        )
+        self.salt, self.sugar = (
+            Ingredient.objects.create(name=name, measurement_unit='г')
+            for name in ('соль', 'сахар')
+        )
+        self.recipe = Recipe.objects.create(
+            author=self.admin, name='Рецепт', text='Описание',
+            cooking_time=10, image='recipes/test.png'
+        )
+        self.tag = Tag.objects.create(
+            name='Завтрак', color='#E26C2D', slug='tag'
+        )
+        self.recipe.tags.add(self.tag)
+        RecipeIngredient.objects.create(
+            recipe=self.recipe, ingredient=self.salt, amount=1
+        )
+        self.favorite = Favorite.objects.create(
+            user=self.admin, recipe=self.recipe
+        )
+        for model, recount in RECOUNTERS.values():
+            recount(model.objects.all())
+        refresh_popularity()
+        self.client.force_login(self.admin)
+
+    def assert_counts(self, model, pk, **counts):
+        self.assertEqual(
+            model.objects.filter(pk=pk).values(*counts).get(), counts
+        )
+
+    def test_inline_edit_recounts_ingredients(self):
+        row = self.recipe.recipe_ingredients.get()
+        response = self.client.post(
+            reverse('admin:recipes_recipe_change', args=[self.recipe.pk]), {
+                'name': 'Рецепт', 'text': 'Описание', 'cooking_time': 10,
+                'author': self.admin.pk, 'tags': [self.tag.pk],
+                'recipe_ingredients-TOTAL_FORMS': 1,
+                'recipe_ingredients-INITIAL_FORMS': 1,
+                'recipe_ingredients-0-id': row.pk,
+                'recipe_ingredients-0-recipe': self.recipe.pk,
+                'recipe_ingredients-0-ingredient': self.sugar.pk,
+                'recipe_ingredients-0-amount': 2,
+            }
+        )
+        self.assertEqual(response.status_code, 302)
+        self.assert_counts(Ingredient, self.salt.pk, recipes_count=0)
+        self.assert_counts(Ingredient, self.sugar.pk, recipes_count=1)
+
+    def test_recipe_delete_recounts_author_and_ingredients(self):
+        response = self.client.post(
+            reverse('admin:recipes_recipe_delete', args=[self.recipe.pk]),
+            {'post': 'yes'}
+        )
+        self.assertEqual(response.status_code, 302)
+        self.assert_counts(User, self.admin.pk, recipes_count=0)
+        self.assert_counts(Ingredient, self.salt.pk, recipes_count=0)
+
+    def test_favorite_delete_recounts_recipe(self):
+        response = self.client.post(
+            reverse('admin:recipes_favorite_changelist'), {
+                'action': 'delete_selected', 'post': 'yes',
+                '_selected_action': [self.favorite.pk],
+            }
+        )
+        self.assertEqual(response.status_code, 302)
+        self.assert_counts(Recipe, self.recipe.pk, favorites_count=0)
+        self.assert_counts(
+            RecipePopularity, self.recipe.pk, score_all=0
+        )
@@ -15,9 +15,9 @@ class UserAdmin(BaseUserAdmin):
         'get_full_name',
         'email',
         'get_avatar_preview',
-        'get_recipes_count',
-        'get_subscriptions_count',
-        'get_followers_count',
+        'recipes_count',
+        'following_count',
+        'followers_count',
         'is_staff',
         'is_active',
     )
@@ -29,6 +29,9 @@ class UserAdmin(BaseUserAdmin):
     )
 
     ordering = ('username',)
+    show_full_result_count = False
+
+    readonly_fields = ('recipes_count', 'following_count', 'followers_count')
 
     fieldsets = (
         (None, {'fields': ('username', 'password')}),
@@ -40,6 +43,9 @@ class UserAdmin(BaseUserAdmin):
                        'user_permissions'),
         }),
         ('Важные даты', {'fields': ('last_login', 'date_joined')}),
+        ('Статистика', {
+            'fields': ('recipes_count', 'following_count', 'followers_count')
+        }),
     )
 
     add_fieldsets = (
@@ -61,15 +67,3 @@ class UserAdmin(BaseUserAdmin):
         if user.avatar:
             return mark_safe(f'<img src="{user.avatar.url}" width="40" height="40" style="object-fit:cover; border-radius:50%;" />')
         return '-'
-
-    @admin.display(description='Рецептов')
-    def get_recipes_count(self, user):
-        return user.recipes.count()
-
-    @admin.display(description='Подписок')
-    def get_subscriptions_count(self, user):
-        return user.subscriptions.count()
-
-    @admin.display(description='Подписчиков')
-    def get_followers_count(self, user):
-        return user.subscribers.count()
\ No newline at end of file
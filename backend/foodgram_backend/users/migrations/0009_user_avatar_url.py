@@ -0,0 +1,24 @@
+# Generated by Django 4.2.19 on 2026-10-18 18:58
+
+from django.db import migrations, models
+import recipes.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0008_user_avatar_renditions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='avatar_url',
+            field=models.CharField(blank=True, editable=False, max_length=255, verbose_name='Адрес аватара'),
+        ),
+        migrations.AlterField(
+            model_name='user',
+            name='avatar',
+            field=recipes.fields.ContentHashImageField(blank=True, help_text='Загрузите ваш аватар', null=True, upload_to='avatars/', url_field='avatar_url', verbose_name='Аватар'),
+        ),
+    ]
@@ -8,9 +8,16 @@ from constants import (
     USER_LAST_NAME_MAX_LENGTH,
     USER_USERNAME_MAX_LENGTH,
 )
+from recipes.fields import ContentHashImageField
+from recipes.mixins import DenormalizedFieldsMixin
 
 
-class User(AbstractUser):
+class User(DenormalizedFieldsMixin, AbstractUser):
+    denormalized_fields = (
+        'recipes_count', 'followers_count', 'following_count',
+        'shopping_cart_version', 'avatar_renditions'
+    )
+
     username_validator = UnicodeUsernameValidator
 
     email = models.EmailField(
@@ -46,14 +53,64 @@ class User(AbstractUser):
         max_length=USER_LAST_NAME_MAX_LENGTH
     )
 
-    avatar = models.ImageField(
+    avatar = ContentHashImageField(
         verbose_name='Аватар',
         upload_to='avatars/',
+        url_field='avatar_url',
         blank=True,
         null=True,
         help_text='Загрузите ваш аватар'
     )
 
+    avatar_url = models.CharField(
+        verbose_name='Адрес аватара',
+        max_length=255,
+        blank=True,
+        editable=False
+    )
+
+    avatar_renditions = models.JSONField(
+        verbose_name='Уменьшенные копии аватара',
+        default=dict,
+        blank=True,
+        editable=False
+    )
+
+    recipes_count = models.PositiveIntegerField(
+        verbose_name='Рецептов',
+        default=0,
+        editable=False
+    )
+
+    followers_count = models.PositiveIntegerField(
+        verbose_name='Подписчиков',
+        default=0,
+        editable=False
+    )
+
+    following_count = models.PositiveIntegerField(
+        verbose_name='Подписок',
+        default=0,
+        editable=False
+    )
+
+    shopping_cart_version = models.PositiveIntegerField(
+        verbose_name='Версия списка покупок',
+        default=0,
+        editable=False
+    )
+
+    updated_at = models.DateTimeField(
+        verbose_name='Дата изменения',
+        auto_now=True
+    )
+
+    version = models.PositiveIntegerField(
+        verbose_name='Версия',
+        default=0,
+        editable=False
+    )
+
     USERNAME_FIELD = 'email'
 
     REQUIRED_FIELDS = [
@@ -70,6 +127,20 @@ class User(AbstractUser):
     def __str__(self):
         return self.username
 
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        # Logging in stores last_login, which is not part of any
+        # representation and must not change the validators.
+        if update_fields is not None and set(update_fields) <= {'last_login'}:
+            super().save(*args, **kwargs)
+            return
+        self.version += 1
+        if update_fields is not None:
+            kwargs['update_fields'] = {
+                *update_fields, 'version', 'updated_at'
+            }
+        super().save(*args, **kwargs)
+
 
 class Subscription(models.Model):
     subscriber = models.ForeignKey(
@@ -94,7 +165,13 @@ class Subscription(models.Model):
     class Meta:
         verbose_name = 'Подписка'
         verbose_name_plural = 'Подписки'
-        ordering = ['-subscription_date']
+        ordering = ['-subscription_date', '-id']
+        indexes = [
+            models.Index(
+                fields=['subscriber', '-subscription_date', '-id'],
+                name='subscription_feed_idx'
+            ),
+        ]
         constraints = [
             models.UniqueConstraint(
                 fields=['subscriber', 'author'],